@@ -5,14 +5,21 @@ Administrative tools for the Assignment Submission System
 
 from database_manager import DatabaseManager
 from plagiarism_detector import PlagiarismDetector
+from file_processor import FileProcessor
+from extraction_cache import ExtractionCache
+from blob_store import BlobStore
+import json
 import os
 import sqlite3
 from datetime import datetime, timedelta
+from itertools import islice
 
 class AdminTools:
     def __init__(self):
         self.db_manager = DatabaseManager()
-        self.plagiarism_detector = PlagiarismDetector()
+        self.plagiarism_detector = PlagiarismDetector(db_manager=self.db_manager)
+        self.file_processor = FileProcessor(extraction_cache=ExtractionCache())
+        self.blob_store = BlobStore('uploads')
     
     def create_sample_data(self):
         """Create sample assignments and submissions for testing"""
@@ -83,7 +90,8 @@ class AdminTools:
         cursor.execute("SELECT COUNT(*) FROM submissions WHERE score IS NOT NULL")
         graded_submissions = cursor.fetchone()[0]
         
-        cursor.execute("SELECT AVG(plagiarism_score) FROM submissions")
+        # Pending and failed submissions still hold the 0.0 placeholder score
+        cursor.execute("SELECT AVG(plagiarism_score) FROM submissions WHERE status = 'scored'")
         avg_plagiarism = cursor.fetchone()[0] or 0
         
         print(f"Total Submissions: {total_submissions}")
@@ -91,7 +99,7 @@ class AdminTools:
         print(f"Average Plagiarism Score: {avg_plagiarism:.2f}%")
         
         # High plagiarism submissions
-        cursor.execute("SELECT COUNT(*) FROM submissions WHERE plagiarism_score > 30")
+        cursor.execute("SELECT COUNT(*) FROM submissions WHERE status = 'scored' AND plagiarism_score > 30")
         high_plagiarism = cursor.fetchone()[0]
         
         print(f"High Plagiarism Submissions (>30%): {high_plagiarism}")
@@ -126,18 +134,29 @@ class AdminTools:
         cutoff_date = datetime.now() - timedelta(days=days_old)
         cleaned_count = 0
         
-        for filename in os.listdir(upload_dir):
-            filepath = os.path.join(upload_dir, filename)
+        # Blobs are found through the database instead of walking the sharded directories
+        for filepath in self.db_manager.get_expired_file_paths(days_old):
             if os.path.isfile(filepath):
-                file_time = datetime.fromtimestamp(os.path.getmtime(filepath))
+                try:
+                    self.blob_store.remove(filepath)
+                    cleaned_count += 1
+                    print(f"Removed: {filepath}")
+                except Exception as e:
+                    print(f"Error removing {filepath}: {e}")
+        
+        # Files uploaded before the blob store sit directly in the upload directory
+        for entry in os.scandir(upload_dir):
+            if entry.is_file():
+                file_time = datetime.fromtimestamp(entry.stat().st_mtime)
                 if file_time < cutoff_date:
                     try:
-                        os.remove(filepath)
+                        os.remove(entry.path)
                         cleaned_count += 1
-                        print(f"Removed: {filename}")
+                        print(f"Removed: {entry.name}")
                     except Exception as e:
-                        print(f"Error removing {filename}: {e}")
+                        print(f"Error removing {entry.name}: {e}")
         
+        cleaned_count += self.blob_store.remove_stale_temp_files(cutoff_date.timestamp())
         print(f"Cleanup complete. Removed {cleaned_count} files.")
     
     def backup_database(self):
@@ -146,38 +165,106 @@ class AdminTools:
         backup_filename = f"backup_assignment_system_{timestamp}.db"
         
         try:
-            # Copy database file
-            import shutil
-            shutil.copy2('assignment_system.db', backup_filename)
+            # The backup API also captures commits not yet checkpointed out of the WAL
+            self.db_manager.backup(backup_filename)
             print(f"Database backup created: {backup_filename}")
         except Exception as e:
             print(f"Backup failed: {e}")
     
-    def reset_plagiarism_scores(self):
-        """Recalculate all plagiarism scores"""
+    def reset_plagiarism_scores(self, batch_size=256, reextract=False):
+        """Recalculate all plagiarism scores, optionally re-deriving each submission's text first"""
+        if reextract:
+            self.reextract_submissions()
+        
         print("Recalculating plagiarism scores...")
         
         conn = self.db_manager.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute("SELECT id, content FROM submissions WHERE content IS NOT NULL")
-        submissions = cursor.fetchall()
+        # Texts are paged in, so only one batch is held in memory at a time
+        submissions = self.db_manager.get_submission_texts(batch_size)
         
         updated_count = 0
-        for submission_id, content in submissions:
-            if content:
-                new_score = self.plagiarism_detector.detect_plagiarism(content)
-                cursor.execute(
-                    "UPDATE submissions SET plagiarism_score = ? WHERE id = ?",
-                    (new_score, submission_id)
-                )
-                updated_count += 1
+        while True:
+            batch = list(islice(submissions, batch_size))
+            if not batch:
+                break
+            submission_ids, assignment_ids, student_ids, filenames, contents = (list(column) for column in zip(*batch))
+            new_scores = self.plagiarism_detector.detect_plagiarism_batch(
+                contents, assignment_ids, submission_ids, filenames, student_ids
+            )
+            
+            cursor.executemany(
+                "UPDATE submissions SET plagiarism_score = ? WHERE id = ?",
+                list(zip(new_scores, submission_ids))
+            )
+            # Stored reports still show the old scores
+            self.db_manager.delete_plagiarism_reports(cursor, submission_ids)
+            # Committing per batch keeps the write lock free while the next batch is scored
+            conn.commit()
+            for submission_id, new_score in zip(submission_ids, new_scores):
                 print(f"Updated submission {submission_id}: {new_score:.2f}%")
+            updated_count += len(batch)
         
-        conn.commit()
         conn.close()
         
         print(f"Updated {updated_count} submissions.")
+    
+    def reextract_submissions(self, batch_size=50):
+        """Refresh stored text from the extraction cache, parsing an original only on a cache miss"""
+        print("Re-extracting submission text...")
+        
+        conn = self.db_manager.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT id, file_path, file_digest FROM submissions WHERE file_digest IS NOT NULL")
+        submissions = cursor.fetchall()
+        
+        # Files are parsed outside any transaction; each batch of results is written in a short one,
+        # so uploads are not kept waiting for the write lock while originals are parsed
+        batch = []
+        updated_count = 0
+        parsed_count = 0
+        for submission_id, file_path, file_digest in submissions:
+            extracted = self.file_processor.cached_extraction(file_path, file_digest)
+            if extracted is None:
+                if not os.path.exists(file_path):
+                    continue
+                extracted = self.file_processor.extract_text_with_pages(file_path, file_digest)
+                parsed_count += 1
+            text, page_offsets = extracted
+            if text:
+                batch.append((submission_id, text, page_offsets))
+            if len(batch) >= batch_size:
+                updated_count += self.save_extracted_texts(conn, batch)
+                batch = []
+        updated_count += self.save_extracted_texts(conn, batch)
+        conn.close()
+        
+        # Indexes were built from the old text
+        self.db_manager.rebuild_submission_indexes()
+        print(f"Re-extracted {updated_count} submissions ({parsed_count} parsed from the original files).")
+    
+    def save_extracted_texts(self, conn, batch):
+        cursor = conn.cursor()
+        try:
+            for submission_id, text, _ in batch:
+                self.db_manager.save_submission_text(cursor, submission_id, text)
+            cursor.executemany("UPDATE submissions SET page_offsets = ? WHERE id = ?", [
+                (json.dumps(page_offsets) if page_offsets else None, submission_id)
+                for submission_id, _, page_offsets in batch
+            ])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return len(batch)
+    
+    def rebuild_submission_indexes(self):
+        """Rebuild the similarity and near-duplicate indexes from stored submissions"""
+        print("Rebuilding submission indexes...")
+        indexed_count = self.db_manager.rebuild_submission_indexes()
+        print(f"Indexed {indexed_count} submissions.")
 
 def main():
     """Main admin interface"""
@@ -192,9 +279,10 @@ def main():
         print("3. Cleanup old files")
         print("4. Backup database")
         print("5. Reset plagiarism scores")
-        print("6. Exit")
+        print("6. Rebuild submission indexes")
+        print("7. Exit")
         
-        choice = input("\nSelect option (1-6): ").strip()
+        choice = input("\nSelect option (1-7): ").strip()
         
         if choice == '1':
             admin.create_sample_data()
@@ -207,8 +295,11 @@ def main():
         elif choice == '4':
             admin.backup_database()
         elif choice == '5':
-            admin.reset_plagiarism_scores()
+            reextract = input("Re-extract text first? (y/N): ").strip().lower() == 'y'
+            admin.reset_plagiarism_scores(reextract=reextract)
         elif choice == '6':
+            admin.rebuild_submission_indexes()
+        elif choice == '7':
             print("Goodbye!")
             break
         else:
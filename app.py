@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, Response
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import sqlite3
@@ -8,6 +8,11 @@ import hashlib
 from plagiarism_detector import PlagiarismDetector
 from database_manager import DatabaseManager
 from file_processor import FileProcessor
+from submission_worker import SubmissionWorker
+from scoring_pool import ScoringPool
+from status_events import StatusBroker
+from extraction_cache import ExtractionCache
+from blob_store import BlobStore
 import json
 
 app = Flask(__name__)
@@ -17,11 +22,25 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
 # Initialize components
 db_manager = DatabaseManager()
-plagiarism_detector = PlagiarismDetector()
-file_processor = FileProcessor()
+db_manager.init_app(app)
+plagiarism_detector = PlagiarismDetector(db_manager=db_manager)
+file_processor = FileProcessor(extraction_cache=ExtractionCache())
+
+# PDF parsing and model scoring are CPU-bound, so they run in separate processes
+# and the worker threads only wait on them
+scoring_pool = ScoringPool(plagiarism_detector.model_path, db_manager.db_path, file_processor=file_processor)
+status_broker = StatusBroker()
+submission_worker = SubmissionWorker(db_manager, plagiarism_detector, file_processor,
+                                     num_workers=scoring_pool.processes, scoring_pool=scoring_pool,
+                                     status_broker=status_broker)
 
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+blob_store = BlobStore(app.config['UPLOAD_FOLDER'])
+
+@app.before_request
+def start_submission_worker():
+    submission_worker.start()
 
 @app.route('/')
 def home():
@@ -147,24 +166,24 @@ def submit_assignment(assignment_id):
             return redirect(request.url)
         
         if file and file_processor.allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{session['user_id']}_{assignment_id}_{timestamp}_{filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            # Process file and detect plagiarism
-            file_content = file_processor.extract_text(filepath)
-            plagiarism_score = plagiarism_detector.detect_plagiarism(file_content)
+            # One pass over the upload hashes, size-checks, sniffs and stores it under its SHA-256,
+            # decoding small text and code files from memory; the original filename is kept in the database
+            blob, error = file_processor.ingest_upload(file.stream, file.filename, blob_store, extract=True)
+            if error:
+                flash(error)
+                return redirect(request.url)
+            filename = secure_filename(file.filename) or f"upload.{blob['file_type']}"
             
-            # Save submission to database
-            submission_id = db_manager.create_submission(
-                assignment_id, session['user_id'], filename, filepath, 
-                plagiarism_score, file_content
+            # Extraction and plagiarism scoring run in the background worker pool
+            submission_id = db_manager.create_pending_submission(
+                assignment_id, session['user_id'], filename, blob['path'], blob['digest'], blob['size'],
+                blob.get('text'), blob.get('page_offsets')
             )
             
             if submission_id:
-                flash(f'Assignment submitted successfully! Plagiarism score: {plagiarism_score:.2f}%')
+                status_broker.publish(submission_id, 'stored')
+                submission_worker.notify()
+                flash('Assignment submitted successfully! Plagiarism check in progress.')
                 return redirect(url_for('student_dashboard'))
             else:
                 flash('Failed to submit assignment.')
@@ -208,19 +227,43 @@ def download_submission(submission_id):
     
     submission = db_manager.get_submission(submission_id)
     if submission and os.path.exists(submission['file_path']):
-        return send_file(submission['file_path'], as_attachment=True)
+        return send_file(os.path.abspath(submission['file_path']), as_attachment=True,
+                         download_name=submission['filename'])
     else:
         flash('File not found.')
         return redirect(request.referrer)
 
+def get_or_create_report(submission):
+    """Serve the stored report, regenerating it if the detector has changed since
+    
+    Re-scoring a submission deletes its stored report, so a changed score is never served stale.
+    """
+    stored = db_manager.get_plagiarism_report(submission['id'])
+    if stored and stored['report_data'] and stored['detector_version'] == plagiarism_detector.version:
+        return stored['report_data']
+    
+    # The text is only loaded when the report has to be regenerated
+    report = plagiarism_detector.get_detailed_report(
+        db_manager.get_submission_text(submission['id']), submission['assignment_id'], submission['id'], submission['filename'],
+        page_offsets=submission['page_offsets'], student_id=submission['student_id']
+    )
+    db_manager.save_plagiarism_report(submission['id'], report, plagiarism_detector.version)
+    return report
+
 @app.route('/plagiarism_report/<int:submission_id>')
 def plagiarism_report(submission_id):
     if 'user_id' not in session or session['user_type'] != 'lecturer':
         return redirect(url_for('login'))
     
     submission = db_manager.get_submission(submission_id)
-    if submission:
-        detailed_report = plagiarism_detector.get_detailed_report(submission['content'])
+    if submission and submission['status'] in ('stored', 'extracted'):
+        flash('Plagiarism check is still in progress for this submission.')
+        return redirect(request.referrer or url_for('lecturer_dashboard'))
+    elif submission and submission['status'] == 'failed':
+        flash('Plagiarism check failed for this submission.')
+        return redirect(request.referrer or url_for('lecturer_dashboard'))
+    elif submission:
+        detailed_report = get_or_create_report(submission)
         return render_template('plagiarism_report.html',
                              submission=submission,
                              report=detailed_report,
@@ -242,6 +285,53 @@ def plagiarism_stats():
     stats = db_manager.get_plagiarism_statistics()
     return jsonify(stats)
 
+@app.route('/api/cache_stats')
+def cache_stats():
+    if 'user_id' not in session or session['user_type'] != 'lecturer':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify(plagiarism_detector.cache.stats())
+
+def get_submission_status(submission_id):
+    """Current status of a submission the logged-in user may see, or None"""
+    status = db_manager.get_submission_status(submission_id)
+    if status is None:
+        return None
+    if session['user_type'] == 'student' and status['student_id'] != session['user_id']:
+        return None
+    
+    event = status_broker.latest(submission_id) or {
+        'submission_id': submission_id,
+        'status': status['status'],
+        'plagiarism_score': status['plagiarism_score']
+    }
+    if event['status'] != 'scored':
+        event = dict(event, plagiarism_score=None)
+    return event
+
+@app.route('/api/submissions/<int:submission_id>/status')
+def submission_status(submission_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    status = get_submission_status(submission_id)
+    if status is None:
+        return jsonify({'error': 'Submission not found'}), 404
+    return jsonify(status)
+
+@app.route('/api/submissions/<int:submission_id>/events')
+def submission_events(submission_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    status = get_submission_status(submission_id)
+    if status is None:
+        return jsonify({'error': 'Submission not found'}), 404
+    
+    # Transitions come from the worker through the broker, not from polling the database
+    return Response(status_broker.stream(submission_id, status), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # Error handlers
 @app.errorhandler(404)
 def not_found_error(error):
@@ -258,4 +348,5 @@ def too_large(error):
 
 if __name__ == '__main__':
     db_manager.init_database()
+    submission_worker.start()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,105 @@
+"""
+Content-addressed upload storage: files named by SHA-256 in two-level sharded directories
+"""
+
+import hashlib
+import os
+import tempfile
+
+class BlobStore:
+    def __init__(self, root='uploads', chunk_size=1024 * 1024):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.temp_dir = os.path.join(root, 'tmp')
+
+    def path_for(self, digest, extension=''):
+        """uploads/ab/cd/abcd....ext; the extension is kept because it selects the extractor"""
+        name = f"{digest}.{extension}" if extension else digest
+        return os.path.join(self.root, digest[:2], digest[2:4], name)
+
+    def put(self, stream, extension=''):
+        """Stream a file into the store, returning its path, digest and size"""
+        writer = self.writer()
+        try:
+            for chunk in iter(lambda: stream.read(self.chunk_size), b''):
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.commit(extension)
+
+    def writer(self):
+        """A BlobWriter for callers that inspect chunks as they are written"""
+        return BlobWriter(self)
+
+    def is_blob_path(self, path):
+        """Whether path sits in a shard directory of this store"""
+        shard = os.path.dirname(os.path.dirname(os.path.normpath(path)))
+        return os.path.dirname(shard) == os.path.normpath(self.root)
+
+    def remove(self, path):
+        """Delete a blob and any shard directories it leaves empty"""
+        os.remove(path)
+        if not self.is_blob_path(path):
+            return
+        for directory in (os.path.dirname(path), os.path.dirname(os.path.dirname(path))):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+
+    def remove_stale_temp_files(self, cutoff_timestamp):
+        """Delete temp files abandoned by interrupted writes; returns how many"""
+        removed = 0
+        if not os.path.isdir(self.temp_dir):
+            return removed
+        for entry in os.scandir(self.temp_dir):
+            if entry.is_file() and entry.stat().st_mtime < cutoff_timestamp:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+class BlobWriter:
+    """Writes one blob to a temp file while hashing it; commit renames it into place
+
+    Readers never see a partial blob and identical uploads are stored once.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        os.makedirs(store.temp_dir, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(dir=store.temp_dir)
+        self.file = os.fdopen(fd, 'wb')
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk):
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        self.file.write(chunk)
+
+    def commit(self, extension=''):
+        try:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+
+            digest = self.digest.hexdigest()
+            path = self.store.path_for(digest, extension)
+            if os.path.exists(path):
+                os.remove(self.temp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(self.temp_path, path)
+        except BaseException:
+            self.abort()
+            raise
+        return {'path': path, 'digest': digest, 'size': self.size}
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
@@ -0,0 +1,225 @@
+"""
+MOSS-style winnowing fingerprints and a per-assignment index for code submissions
+"""
+
+import re
+import zlib
+from collections import defaultdict
+
+CODE_EXTENSIONS = {'py', 'java', 'c', 'cpp', 'js'}
+
+KEYWORDS = {
+    # Python
+    'and', 'as', 'assert', 'async', 'await', 'break', 'class', 'continue', 'def', 'del',
+    'elif', 'else', 'except', 'finally', 'for', 'from', 'global', 'if', 'import', 'in',
+    'is', 'lambda', 'nonlocal', 'not', 'or', 'pass', 'raise', 'return', 'try', 'while',
+    'with', 'yield', 'None', 'True', 'False', 'self', 'print',
+    # C, C++, Java and JavaScript
+    'abstract', 'auto', 'bool', 'boolean', 'byte', 'case', 'catch', 'char', 'const',
+    'default', 'delete', 'do', 'double', 'enum', 'extends', 'extern', 'final', 'float',
+    'function', 'goto', 'implements', 'include', 'instanceof', 'int', 'interface', 'let',
+    'long', 'namespace', 'new', 'null', 'package', 'private', 'protected', 'public',
+    'short', 'signed', 'sizeof', 'static', 'struct', 'super', 'switch', 'template',
+    'this', 'throw', 'throws', 'typedef', 'typeof', 'union', 'unsigned', 'using', 'var',
+    'virtual', 'void', 'volatile', 'true', 'false', 'std', 'string', 'String',
+}
+
+TOKEN_PATTERN = re.compile(r'''
+    (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+  | (?P<number>\d+(?:\.\d+)?)
+  | (?P<name>[A-Za-z_]\w*)
+  | (?P<newline>\n)
+  | (?P<op>==|!=|<=|>=|&&|\|\||\+\+|--|->|::|[^\s\w])
+''', re.VERBOSE)
+
+HASH_BASE = 257
+HASH_MODULUS = (1 << 61) - 1
+
+def is_code_file(filename):
+    """True if the filename's extension is fingerprinted as source code"""
+    return bool(filename) and '.' in filename and \
+        filename.rsplit('.', 1)[1].lower() in CODE_EXTENSIONS
+
+def normalize_tokens(source):
+    """Token stream with identifiers, numbers and strings collapsed, as (token, line) pairs"""
+    tokens = []
+    line = 1
+    for match in TOKEN_PATTERN.finditer(source or ''):
+        kind = match.lastgroup
+        value = match.group()
+        if kind == 'newline':
+            line += 1
+            continue
+        if kind == 'name':
+            value = value if value in KEYWORDS else 'V'
+        elif kind == 'number':
+            value = 'N'
+        elif kind == 'string':
+            value = 'S'
+        tokens.append((value, line))
+    return tokens
+
+def kgram_hashes(tokens, k):
+    """Karp-Rabin rolling hashes of every k-gram, as (hash, start_line, end_line)"""
+    if len(tokens) < k:
+        return []
+
+    token_codes = [zlib.crc32(token.encode('utf-8')) for token, _ in tokens]
+    high_power = pow(HASH_BASE, k - 1, HASH_MODULUS)
+
+    current = 0
+    for code in token_codes[:k]:
+        current = (current * HASH_BASE + code) % HASH_MODULUS
+
+    hashes = [(current, tokens[0][1], tokens[k - 1][1])]
+    for i in range(k, len(tokens)):
+        current = (current - token_codes[i - k] * high_power) % HASH_MODULUS
+        current = (current * HASH_BASE + token_codes[i]) % HASH_MODULUS
+        hashes.append((current, tokens[i - k + 1][1], tokens[i][1]))
+    return hashes
+
+def winnow(hashes, window):
+    """Robust winnowing: keep the rightmost minimum hash of every window"""
+    if not hashes:
+        return []
+    if len(hashes) <= window:
+        return [min(reversed(hashes), key=lambda item: item[0])]
+
+    fingerprints = []
+    min_index = -1
+    for start in range(len(hashes) - window + 1):
+        end = start + window
+        if min_index < start:
+            # Previous minimum slid out of the window; rescan it
+            min_index = start
+            for i in range(start + 1, end):
+                if hashes[i][0] <= hashes[min_index][0]:
+                    min_index = i
+            fingerprints.append(hashes[min_index])
+        elif hashes[end - 1][0] <= hashes[min_index][0]:
+            min_index = end - 1
+            fingerprints.append(hashes[min_index])
+    return fingerprints
+
+def fingerprint(source, k=5, window=4):
+    """Winnowed fingerprints of a source file"""
+    return winnow(kgram_hashes(normalize_tokens(source), k), window)
+
+def merge_regions(regions):
+    """Merge overlapping or adjacent (start_line, end_line) ranges"""
+    merged = []
+    for start, end in sorted(regions):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(region) for region in merged]
+
+class FingerprintIndex:
+    def __init__(self, get_connection, k=5, window=4):
+        self.get_connection = get_connection
+        self.k = k
+        self.window = window
+
+    def create_tables(self, cursor):
+        """Create the inverted fingerprint index on an open cursor"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS code_fingerprints (
+                assignment_id INTEGER NOT NULL,
+                hash INTEGER NOT NULL,
+                submission_id INTEGER NOT NULL,
+                start_line INTEGER NOT NULL,
+                end_line INTEGER NOT NULL
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_code_fingerprints_hash
+            ON code_fingerprints (assignment_id, hash)
+        ''')
+
+        # Also keys each fingerprint, so indexing a submission twice cannot duplicate rows
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_code_fingerprints_submission
+            ON code_fingerprints (submission_id, hash, start_line, end_line)
+        ''')
+
+    def fingerprint(self, source):
+        """Fingerprints of a source file, or of a list of (first_line, text) parts of one document"""
+        if isinstance(source, list):
+            # Each part is winnowed on its own so no k-gram spans two files
+            return [
+                (value, start + first_line - 1, end + first_line - 1)
+                for first_line, text in source
+                for value, start, end in fingerprint(text, self.k, self.window)
+            ]
+        # Fingerprints need the raw layout, not the preprocessed prose form
+        source = getattr(source, 'text', source)
+        return fingerprint(source, self.k, self.window)
+
+    def add_document(self, cursor, assignment_id, submission_id, source):
+        """Index a code submission using the caller's cursor"""
+        fingerprints = self.fingerprint(source)
+        cursor.executemany('''
+            INSERT OR IGNORE INTO code_fingerprints (assignment_id, hash, submission_id, start_line, end_line)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(assignment_id, value, submission_id, start, end) for value, start, end in fingerprints])
+        return bool(fingerprints)
+
+    def remove_document(self, cursor, submission_id):
+        """Drop a submission's fingerprints using the caller's cursor"""
+        cursor.execute('DELETE FROM code_fingerprints WHERE submission_id = ?', (submission_id,))
+
+    def query(self, assignment_id, source, k=5, exclude_submission_id=None, exclude_student_id=None):
+        """Submissions sharing fingerprints with source, with matching line regions"""
+        fingerprints = self.fingerprint(source)
+        if not fingerprints:
+            return []
+
+        query_regions = defaultdict(list)
+        for value, start, end in fingerprints:
+            query_regions[value].append((start, end))
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        try:
+            excluded = {exclude_submission_id}
+            if exclude_student_id is not None:
+                cursor.execute(
+                    'SELECT id FROM submissions WHERE student_id = ? AND assignment_id = ?',
+                    (exclude_student_id, assignment_id)
+                )
+                excluded.update(row[0] for row in cursor.fetchall())
+
+            matched_hashes = defaultdict(set)
+            matched_regions = defaultdict(list)
+            other_regions = defaultdict(list)
+
+            hashes = list(query_regions)
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                cursor.execute(f'''
+                    SELECT hash, submission_id, start_line, end_line FROM code_fingerprints
+                    WHERE assignment_id = ? AND hash IN ({','.join('?' * len(chunk))})
+                ''', [assignment_id] + chunk)
+                for value, submission_id, other_start, other_end in cursor.fetchall():
+                    if submission_id in excluded:
+                        continue
+                    matched_hashes[submission_id].add(value)
+                    matched_regions[submission_id].extend(query_regions[value])
+                    other_regions[submission_id].append((other_start, other_end))
+        finally:
+            conn.close()
+
+        results = [
+            {
+                'submission_id': submission_id,
+                'score': round(len(values) / len(query_regions), 4),
+                'lines': merge_regions(matched_regions[submission_id]),
+                'matched_lines': merge_regions(other_regions[submission_id])
+            }
+            for submission_id, values in matched_hashes.items()
+        ]
+        results.sort(key=lambda result: result['score'], reverse=True)
+        return results[:k]
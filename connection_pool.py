@@ -0,0 +1,222 @@
+"""
+Reusable SQLite connections: a small per-database pool plus one connection per Flask request
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from flask import g, has_app_context
+
+# Per-deployment storage settings; busy_timeout comes first so switching journal mode waits for locks
+STORAGE_PROFILES = {
+    # Readers and writers proceed concurrently; commits are durable once checkpointed
+    'wal': {
+        'pragmas': {
+            'busy_timeout': 5000,
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -64 * 1024,  # KiB
+            'temp_store': 'MEMORY',
+            'wal_autocheckpoint': 1000,  # pages
+            'journal_size_limit': 64 * 1024 * 1024
+        },
+        'checkpoint_interval': 60.0
+    },
+    # SQLite's defaults, for filesystems without shared memory such as network mounts
+    'rollback': {
+        'pragmas': {
+            'busy_timeout': 5000,
+            'journal_mode': 'DELETE',
+            'synchronous': 'FULL'
+        },
+        'checkpoint_interval': None
+    }
+}
+
+class PooledConnection(sqlite3.Connection):
+    """A connection kept by a pool; callers only ever see it through a ConnectionLease"""
+
+    lease = 0  # bumped on every acquisition and release; identifies the current holder
+    last_used = 0.0
+
+    def discard(self):
+        """Really close the connection"""
+        super().close()
+
+class ConnectionLease:
+    """One caller's use of a pooled connection; close() gives it back at most once
+
+    A lease remembers the token it was issued with, so closing it again after the
+    connection has been handed to someone else cannot release that caller's connection.
+    """
+
+    def __init__(self, conn, release):
+        conn.lease += 1
+        self.conn = conn
+        self.token = conn.lease
+        self._release = release
+
+    @property
+    def closed(self):
+        return self.conn.lease != self.token
+
+    def close(self):
+        if not self.closed:
+            self.conn.lease += 1
+            self._release(self.conn)
+
+    def __getattr__(self, name):
+        if self.closed:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed connection.')
+        return getattr(self.conn, name)
+
+    def __enter__(self):
+        return self.conn.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.conn.__exit__(*exc_info)
+
+class ConnectionPool:
+    def __init__(self, db_path, pool_size=5, pragmas=None, health_check_interval=30.0, timeout=5.0,
+                 checkpoint_interval=None):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.pragmas = dict(pragmas or {})
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        
+        # In WAL mode, released connections also run a passive checkpoint this often (seconds)
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = time.monotonic()
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._app_key = f"_db_connection_{id(self)}"
+        self.request_scoped = False
+
+    def connect(self):
+        """A connection for the caller, who closes it when done
+
+        Once init_app has been called, calls inside a Flask app context reuse one connection,
+        which is only returned to the pool when the app context is torn down. It is lent to
+        one caller at a time: a caller that asks while it is still out gets its own connection,
+        so committing cannot commit another caller's unfinished transaction.
+        """
+        if self.request_scoped and has_app_context():
+            return self._request_connection()
+        return self.acquire()
+
+    def acquire(self):
+        """A lease on an idle connection that passes its health check, or on a new one"""
+        return ConnectionLease(self._checkout(), self.release)
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                self._check_fork()
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self.open()
+            if self.is_healthy(conn):
+                return conn
+            conn.discard()
+
+    def release(self, conn):
+        """Take back a connection, discarding any uncommitted work as close() would"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.discard()
+            return
+
+        if self.checkpoint_interval is not None and \
+                time.monotonic() - self.last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint(conn)
+
+        conn.last_used = time.monotonic()
+        with self._lock:
+            self._check_fork()
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.discard()
+
+    def open(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, factory=PooledConnection,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def checkpoint(self, conn, mode='PASSIVE'):
+        """Copy committed WAL frames into the database file; returns (busy, wal frames, checkpointed)
+
+        Automatic checkpoints only run on commit and give up while readers are active, so
+        during bursts of reads this keeps the WAL from growing; journal_size_limit then
+        truncates it. PASSIVE never waits for readers or writers.
+        """
+        self.last_checkpoint = time.monotonic()
+        try:
+            return tuple(conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone())
+        except sqlite3.Error as e:
+            print(f"Error checkpointing {self.db_path}: {e}")
+            return None
+
+    def is_healthy(self, conn):
+        """Connections idle for longer than health_check_interval must answer a trivial query"""
+        if time.monotonic() - conn.last_used < self.health_check_interval:
+            return True
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.discard()
+
+    def _check_fork(self):
+        # A forked child must not share the parent's SQLite handles; it starts with an empty pool
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = []
+
+    def init_app(self, app):
+        """Return the request's connection to the pool when its app context ends"""
+        app.teardown_appcontext(self._teardown_request_connection)
+        self.request_scoped = True
+
+    def _request_connection(self):
+        # g holds the latest lease on the request's connection
+        scoped = g.get(self._app_key)
+        if scoped is None:
+            conn = self._checkout()
+        elif scoped.closed:
+            conn = scoped.conn
+        else:
+            return self.acquire()
+        scoped = ConnectionLease(conn, self._end_request_lease)
+        setattr(g, self._app_key, scoped)
+        return scoped
+
+    def _end_request_lease(self, conn):
+        # Uncommitted work is rolled back, just as closing a private connection would
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            g.pop(self._app_key, None)
+            conn.discard()
+
+    def _teardown_request_connection(self, exception=None):
+        scoped = g.pop(self._app_key, None)
+        if scoped is not None:
+            scoped.conn.lease += 1  # a caller that never closed its lease cannot release it later
+            self.release(scoped.conn)
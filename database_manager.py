@@ -1,87 +1,107 @@
 import sqlite3
 import hashlib
+import os
+import zlib
+import json
 from datetime import datetime
+from itertools import islice
 from werkzeug.security import generate_password_hash, check_password_hash
+from similarity_index import SimilarityIndex
+from near_duplicate import LSHIndex, signature_from_bytes, signature_to_bytes
+from code_fingerprint import FingerprintIndex, is_code_file
+from text_analysis import analyze
+from file_processor import is_archive_file, split_archive_code
+from job_queue import JobQueue
+from connection_pool import ConnectionPool, STORAGE_PROFILES
+from migrations import MigrationRunner
+
+# Columns the dashboards and listings render; the text and index data stay on disk
+SUBMISSION_LIST_COLUMNS = '''
+    s.id, s.assignment_id, s.filename, s.plagiarism_score, s.status, s.score, s.feedback,
+    s.submitted_at, s.graded_at
+'''
+
+def compress_text(text):
+    return zlib.compress(text.encode('utf-8'), 6)
+
+def decompress_text(data):
+    return zlib.decompress(data).decode('utf-8')
 
 class DatabaseManager:
-    def __init__(self, db_path='assignment_system.db'):
+    def __init__(self, db_path='assignment_system.db', pool_size=5, pragmas=None, storage_profile=None):
         self.db_path = db_path
+        
+        # Chosen per deployment; every process sharing the database must use the same profile
+        self.storage_profile = storage_profile or os.environ.get('STORAGE_PROFILE', 'wal')
+        if self.storage_profile not in STORAGE_PROFILES:
+            raise ValueError(f"Unknown storage profile {self.storage_profile!r}; "
+                             f"choose one of {', '.join(STORAGE_PROFILES)}")
+        profile = STORAGE_PROFILES[self.storage_profile]
+        self.pool = ConnectionPool(db_path, pool_size=pool_size, pragmas=dict(profile['pragmas'], **(pragmas or {})),
+                                   checkpoint_interval=profile['checkpoint_interval'])
+        self.similarity_index = SimilarityIndex(self.get_connection)
+        self.lsh_index = LSHIndex(self.get_connection)
+        self.fingerprint_index = FingerprintIndex(self.get_connection)
+        self.job_queue = JobQueue(self.get_connection)
+        self.migrations = MigrationRunner(self)
     
     def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """A pooled connection; close() returns it to the pool rather than closing it"""
+        return self.pool.connect()
+    
+    def checkpoint(self, mode='PASSIVE'):
+        """Checkpoint the WAL now; TRUNCATE waits for readers and also empties the -wal file"""
+        conn = self.pool.acquire()
+        try:
+            return self.pool.checkpoint(conn, mode)
+        finally:
+            conn.close()
+    
+    def backup(self, backup_path):
+        """Consistent copy of the live database, including changes still in the WAL"""
+        conn = self.pool.acquire()
+        backup_conn = sqlite3.connect(backup_path)
+        try:
+            conn.backup(backup_conn)
+        finally:
+            backup_conn.close()
+            conn.close()
+    
+    def init_app(self, app):
+        """Share one connection across all the queries of each Flask request"""
+        self.pool.init_app(app)
     
     def init_database(self):
+        """Bring the schema up to date by applying any pending migrations"""
+        self.migrations.migrate()
+        
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # Users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                full_name TEXT NOT NULL,
-                email TEXT NOT NULL,
-                user_type TEXT NOT NULL CHECK (user_type IN ('student', 'lecturer')),
-                student_id TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Assignments table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS assignments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                description TEXT,
-                due_date DATE NOT NULL,
-                max_score INTEGER DEFAULT 100,
-                lecturer_id INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (lecturer_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Submissions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS submissions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                assignment_id INTEGER NOT NULL,
-                student_id INTEGER NOT NULL,
-                filename TEXT NOT NULL,
-                file_path TEXT NOT NULL,
-                content TEXT,
-                plagiarism_score REAL DEFAULT 0.0,
-                score INTEGER,
-                feedback TEXT,
-                submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                graded_at TIMESTAMP,
-                FOREIGN KEY (assignment_id) REFERENCES assignments (id),
-                FOREIGN KEY (student_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Plagiarism reports table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS plagiarism_reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                submission_id INTEGER NOT NULL,
-                similarity_score REAL NOT NULL,
-                matched_content TEXT,
-                report_data TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (submission_id) REFERENCES submissions (id)
-            )
-        ''')
-        
-        conn.commit()
+        # Refresh planner statistics for tables whose indexes changed or grew
+        cursor.execute('PRAGMA optimize')
         conn.close()
         
         # Create default admin user
         self.create_default_users()
     
+    def ensure_column(self, cursor, table, column, definition):
+        """Add a column to an existing table if an older database lacks it"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        if column not in [row['name'] for row in cursor.fetchall()]:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    
+    def ensure_index(self, cursor, name, table, columns):
+        """Create an index, or rebuild it if an older database has it on different columns"""
+        sql = f'CREATE INDEX {name} ON {table} ({columns})'
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = ?", (name,))
+        row = cursor.fetchone()
+        if row and row['sql'] == sql:
+            return
+        if row:
+            cursor.execute(f'DROP INDEX {name}')
+        cursor.execute(sql)
+    
     def create_default_users(self):
         # Create default lecturer
         self.create_user('admin', 'admin123', 'System Administrator', 
@@ -162,11 +182,10 @@ class DatabaseManager:
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT a.*, COUNT(s.id) as submission_count
+            SELECT a.*,
+                   (SELECT COUNT(*) FROM submissions s WHERE s.assignment_id = a.id) as submission_count
             FROM assignments a
-            LEFT JOIN submissions s ON a.id = s.assignment_id
             WHERE a.lecturer_id = ?
-            GROUP BY a.id
             ORDER BY a.created_at DESC
         ''', (lecturer_id,))
         
@@ -189,17 +208,20 @@ class DatabaseManager:
         conn.close()
         return dict(assignment) if assignment else None
     
-    def create_submission(self, assignment_id, student_id, filename, file_path, plagiarism_score, content):
+    def create_submission(self, assignment_id, student_id, filename, file_path, plagiarism_score, content,
+                          document=None):
         conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
             cursor.execute('''
-                INSERT INTO submissions (assignment_id, student_id, filename, file_path, 
-                                       plagiarism_score, content)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (assignment_id, student_id, filename, file_path, plagiarism_score, content))
+                INSERT INTO submissions (assignment_id, student_id, filename, file_path, plagiarism_score)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (assignment_id, student_id, filename, file_path, plagiarism_score))
             submission_id = cursor.lastrowid
+            if content:
+                self.save_submission_text(cursor, submission_id, content)
+                self.index_submission(cursor, submission_id, assignment_id, document or content, filename)
             conn.commit()
             return submission_id
         except Exception as e:
@@ -208,12 +230,132 @@ class DatabaseManager:
         finally:
             conn.close()
     
-    def get_student_submissions(self, student_id):
+    def create_pending_submission(self, assignment_id, student_id, filename, file_path, file_digest=None,
+                                  file_size=None, content=None, page_offsets=None):
+        """Record an uploaded file and queue its extraction and scoring in the same transaction
+        
+        content, when the upload was already extracted in memory, spares the worker a disk read.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                INSERT INTO submissions (assignment_id, student_id, filename, file_path, file_digest,
+                                         file_size, page_offsets, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 'stored')
+            ''', (assignment_id, student_id, filename, file_path, file_digest, file_size,
+                  json.dumps(page_offsets) if page_offsets else None))
+            submission_id = cursor.lastrowid
+            if content:
+                self.save_submission_text(cursor, submission_id, content)
+            self.job_queue.enqueue(cursor, 'score_submission', {'submission_id': submission_id})
+            conn.commit()
+            return submission_id
+        except Exception as e:
+            print(f"Error creating submission: {e}")
+            return None
+        finally:
+            conn.close()
+    
+    def complete_submission(self, submission_id, content, plagiarism_score, document=None, page_offsets=None):
+        """Store the extracted text and score of a pending submission and index it"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                UPDATE submissions
+                SET page_offsets = ?, plagiarism_score = ?, status = 'scored'
+                WHERE id = ?
+                RETURNING assignment_id, filename
+            ''', (json.dumps(page_offsets) if page_offsets else None, plagiarism_score, submission_id))
+            row = cursor.fetchone()
+            if row:
+                # A re-run job may have changed the score a stored report shows
+                self.delete_plagiarism_reports(cursor, [submission_id])
+            if row and content:
+                self.save_submission_text(cursor, submission_id, content)
+                self.index_submission(cursor, submission_id, row['assignment_id'],
+                                      document or content, row['filename'])
+            conn.commit()
+            return row is not None
+        finally:
+            conn.close()
+    
+    def save_submission_text(self, cursor, submission_id, content):
+        """Store a submission's extracted text, compressed, outside the submissions row"""
+        cursor.execute('''
+            INSERT INTO submission_texts (submission_id, content, size) VALUES (?, ?, ?)
+            ON CONFLICT (submission_id) DO UPDATE SET content = excluded.content, size = excluded.size
+        ''', (submission_id, compress_text(content), len(content)))
+    
+    def get_submission_text(self, submission_id):
+        """Extracted text of a submission, or None if it has none yet"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # Rows the submission_texts backfill has not reached yet still hold their text inline
         cursor.execute('''
-            SELECT s.*, a.title as assignment_title, a.max_score
+            SELECT t.content AS compressed, s.content AS legacy
+            FROM submissions s
+            LEFT JOIN submission_texts t ON t.submission_id = s.id
+            WHERE s.id = ?
+        ''', (submission_id,))
+        
+        row = cursor.fetchone()
+        conn.close()
+        return self.row_text(row) if row else None
+    
+    def get_submission_texts(self, batch_size=200):
+        """Yield (id, assignment_id, student_id, filename, text) of every submission that has text, in id order
+        
+        Pages through submissions by id, so only batch_size texts are loaded and decompressed at a time.
+        """
+        last_id = 0
+        while True:
+            conn = self.get_connection()
+            try:
+                rows = conn.execute('''
+                    SELECT s.id, s.assignment_id, s.student_id, s.filename, t.content AS compressed, s.content AS legacy
+                    FROM submissions s
+                    LEFT JOIN submission_texts t ON t.submission_id = s.id
+                    WHERE s.id > ? AND (t.content IS NOT NULL OR s.content IS NOT NULL)
+                    ORDER BY s.id
+                    LIMIT ?
+                ''', (last_id, batch_size)).fetchall()
+            finally:
+                conn.close()
+            
+            for row in rows:
+                text = self.row_text(row)
+                if text:
+                    yield row['id'], row['assignment_id'], row['student_id'], row['filename'], text
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1]['id']
+    
+    def row_text(self, row):
+        if row['compressed'] is not None:
+            return decompress_text(row['compressed'])
+        return row['legacy']
+    
+    def update_submission_status(self, submission_id, status):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('UPDATE submissions SET status = ? WHERE id = ?', (status, submission_id))
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def get_student_submissions(self, student_id):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(f'''
+            SELECT {SUBMISSION_LIST_COLUMNS}, a.title as assignment_title, a.max_score
             FROM submissions s
             JOIN assignments a ON s.assignment_id = a.id
             WHERE s.student_id = ?
@@ -228,8 +370,8 @@ class DatabaseManager:
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT s.*, u.full_name as student_name, u.student_id
+        cursor.execute(f'''
+            SELECT {SUBMISSION_LIST_COLUMNS}, u.full_name as student_name, u.student_id
             FROM submissions s
             JOIN users u ON s.student_id = u.id
             WHERE s.assignment_id = ?
@@ -244,8 +386,9 @@ class DatabaseManager:
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT s.*, a.title as assignment_title, u.full_name as student_name
+        cursor.execute(f'''
+            SELECT {SUBMISSION_LIST_COLUMNS}, s.student_id, s.file_path, s.file_digest, s.file_size,
+                   s.page_offsets, s.content_hash, a.title as assignment_title, u.full_name as student_name
             FROM submissions s
             JOIN assignments a ON s.assignment_id = a.id
             JOIN users u ON s.student_id = u.id
@@ -254,7 +397,43 @@ class DatabaseManager:
         
         submission = cursor.fetchone()
         conn.close()
-        return dict(submission) if submission else None
+        if not submission:
+            return None
+        
+        submission = dict(submission)
+        submission['page_offsets'] = json.loads(submission['page_offsets']) if submission['page_offsets'] else None
+        return submission
+    
+    def get_expired_file_paths(self, days_old):
+        """Stored files whose most recent submission is older than days_old days"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # A deduplicated file may back several submissions; keep it while any is recent
+        cursor.execute('''
+            SELECT file_path FROM submissions
+            GROUP BY file_path
+            HAVING MAX(submitted_at) < datetime('now', ?)
+        ''', (f'-{int(days_old)} days',))
+        
+        paths = [row['file_path'] for row in cursor.fetchall()]
+        conn.close()
+        return paths
+    
+    def get_submission_status(self, submission_id):
+        """Status fields of a submission without its content, for the status API"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT id as submission_id, student_id, status, plagiarism_score
+            FROM submissions
+            WHERE id = ?
+        ''', (submission_id,))
+        
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row) if row else None
     
     def grade_submission(self, submission_id, score, feedback):
         conn = self.get_connection()
@@ -278,8 +457,8 @@ class DatabaseManager:
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT s.*, a.title as assignment_title, u.full_name as student_name
+        cursor.execute(f'''
+            SELECT {SUBMISSION_LIST_COLUMNS}, a.title as assignment_title, u.full_name as student_name
             FROM submissions s
             JOIN assignments a ON s.assignment_id = a.id
             JOIN users u ON s.student_id = u.id
@@ -291,7 +470,150 @@ class DatabaseManager:
         conn.close()
         return submissions
     
+    def index_submission(self, cursor, submission_id, assignment_id, content, filename=None):
+        """Feed a submission's text into the peer similarity and near-duplicate indexes
+        
+        Safe to repeat, e.g. when a scoring job is re-run after a crash: earlier entries are replaced.
+        """
+        # Tokenize once; every index and the stored summary share the same document
+        document = analyze(content)
+        
+        # Re-adding postings on top of old ones would count the submission twice in df and doc_count
+        self.similarity_index.remove_document(cursor, submission_id)
+        self.fingerprint_index.remove_document(cursor, submission_id)
+        cursor.execute('SELECT minhash FROM submissions WHERE id = ?', (submission_id,))
+        row = cursor.fetchone()
+        if row and row[0]:
+            # The text may have changed since, e.g. after re-extraction, so its old buckets are stale
+            self.lsh_index.remove(cursor, submission_id, signature_from_bytes(row[0]))
+        
+        if is_archive_file(filename):
+            # Source files in a ZIP go to the fingerprint index, everything else to the prose index
+            code_parts, prose = split_archive_code(document.text)
+            indexed = False
+            if code_parts:
+                indexed = self.fingerprint_index.add_document(cursor, assignment_id, submission_id, code_parts)
+            if prose.strip():
+                indexed = self.similarity_index.add_document(cursor, assignment_id, submission_id, prose) or indexed
+        elif is_code_file(filename):
+            indexed = self.fingerprint_index.add_document(cursor, assignment_id, submission_id, document)
+        else:
+            indexed = self.similarity_index.add_document(cursor, assignment_id, submission_id, document)
+        
+        signature = self.lsh_index.signature(document)
+        cursor.execute('UPDATE submissions SET minhash = ?, analysis = ?, content_hash = ? WHERE id = ?', (
+            signature_to_bytes(signature) if signature is not None else None,
+            json.dumps(document.to_dict()),
+            document.content_hash,
+            submission_id
+        ))
+        if signature is not None:
+            self.lsh_index.add(cursor, submission_id, signature)
+        return indexed
+    
+    def rebuild_submission_indexes(self, batch_size=200):
+        """Re-index every stored submission, e.g. after upgrading an existing database
+        
+        As in a migration Backfill, each batch is tokenized before the write lock is taken and then
+        indexed in its own short transaction; index_submission replaces a submission's old entries.
+        """
+        submissions = self.get_submission_texts(batch_size)
+        indexed_count = 0
+        while True:
+            batch = list(islice(submissions, batch_size))
+            if not batch:
+                return indexed_count
+            documents = [analyze(content) for _, _, _, _, content in batch]
+            
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+                for (submission_id, assignment_id, _, filename, _), document in zip(batch, documents):
+                    if self.index_submission(cursor, submission_id, assignment_id, document, filename):
+                        indexed_count += 1
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+    
+    def find_submission_by_content_hash(self, content_hash, exclude_submission_id=None, exclude_student_id=None):
+        """Earliest stored submission whose normalized text hashes to content_hash
+        
+        exclude_student_id skips that student's own submissions, so resubmitting is not a copy.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT id, assignment_id, student_id FROM submissions
+            WHERE content_hash = ? AND id IS NOT ? AND student_id IS NOT ?
+            ORDER BY id
+            LIMIT 1
+        ''', (content_hash, exclude_submission_id, exclude_student_id))
+        
+        submission = cursor.fetchone()
+        conn.close()
+        return dict(submission) if submission else None
+    
+    def save_plagiarism_report(self, submission_id, report, detector_version):
+        """Store the report for a submission, replacing any earlier version"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        best_match = report.get('best_match') or {}
+        if best_match.get('source') == 'reference':
+            matched_content = best_match.get('text')
+        elif best_match.get('submission_id'):
+            matched_content = f"Submission {best_match['submission_id']}"
+        else:
+            matched_content = None
+        
+        try:
+            cursor.execute('DELETE FROM plagiarism_reports WHERE submission_id = ?', (submission_id,))
+            cursor.execute('''
+                INSERT INTO plagiarism_reports (submission_id, similarity_score, matched_content,
+                                                report_data, detector_version)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (submission_id, report['similarity_score'], matched_content,
+                  json.dumps(report), detector_version))
+            conn.commit()
+            return True
+        except Exception as e:
+            print(f"Error saving plagiarism report: {e}")
+            return False
+        finally:
+            conn.close()
+    
+    def delete_plagiarism_reports(self, cursor, submission_ids):
+        """Drop the stored reports of re-scored submissions so they are regenerated when next viewed"""
+        cursor.executemany('DELETE FROM plagiarism_reports WHERE submission_id = ?',
+                           [(submission_id,) for submission_id in submission_ids])
+    
+    def get_plagiarism_report(self, submission_id):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT * FROM plagiarism_reports
+            WHERE submission_id = ?
+            ORDER BY id DESC
+            LIMIT 1
+        ''', (submission_id,))
+        
+        row = cursor.fetchone()
+        conn.close()
+        if not row:
+            return None
+        
+        report = dict(row)
+        report['report_data'] = json.loads(report['report_data']) if report['report_data'] else None
+        return report
+    
     def get_plagiarism_statistics(self):
+        """Score statistics over scored submissions; pending and failed ones only hold a 0.0 placeholder"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -302,6 +624,7 @@ class DatabaseManager:
                 COUNT(CASE WHEN plagiarism_score > 30 THEN 1 END) as high_plagiarism_count,
                 COUNT(CASE WHEN plagiarism_score > 50 THEN 1 END) as very_high_plagiarism_count
             FROM submissions
+            WHERE status = 'scored'
         ''')
         
         stats = dict(cursor.fetchone())
@@ -0,0 +1,97 @@
+"""
+On-disk cache of extracted text, keyed by the file's SHA-256 and the extractor version
+"""
+
+import gzip
+import json
+import os
+import tempfile
+
+class ExtractionCache:
+    def __init__(self, cache_dir='extraction_cache', max_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        # Running estimate of the cache size, recounted from disk when it crosses max_bytes
+        self._approx_bytes = None
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json.gz')
+
+    def get(self, key):
+        """Cached value for key, or None on a miss"""
+        path = self.path_for(key)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                value = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Error reading extraction cache entry {key}: {e}")
+            return None
+
+        # Eviction removes the least recently used entries first
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        """Store value atomically, then evict old entries if the cache is over max_bytes"""
+        path = self.path_for(key)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as file:
+                    json.dump(value, file)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError as e:
+            print(f"Error writing extraction cache entry {key}: {e}")
+            return
+
+        if self._approx_bytes is None:
+            self._approx_bytes = self.size()
+        else:
+            self._approx_bytes += os.path.getsize(path)
+        if self._approx_bytes > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        """(path, size, last used) for every cached entry"""
+        found = []
+        if not os.path.isdir(self.cache_dir):
+            return found
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.json.gz'):
+                    stat = entry.stat()
+                    found.append((entry.path, stat.st_size, stat.st_mtime))
+        return found
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes; returns how many"""
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._approx_bytes = total
+        return removed
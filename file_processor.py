@@ -1,17 +1,96 @@
 import os
+import io
+import re
+import hashlib
 import mimetypes
 from pathlib import Path
-import docx
 import PyPDF2
 import zipfile
+import xml.etree.ElementTree as ET
 import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from code_fingerprint import is_code_file
+
+# Bump whenever extraction output changes so cached text is re-derived
+EXTRACTOR_VERSION = 3
+
+# WordprocessingML namespace used by word/document.xml
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+# Leading bytes of the binary formats we accept
+PDF_MAGIC = b'%PDF-'
+ZIP_MAGIC = b'PK\x03\x04'
+OLE_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+# Line that starts each member's text in the combined document of a ZIP submission
+ARCHIVE_BOUNDARY = '===== {} ====='
+ARCHIVE_BOUNDARY_PATTERN = re.compile(r'===== (.+) =====')
+
+def is_archive_file(filename):
+    return bool(filename) and filename.rsplit('.', 1)[-1].lower() == 'zip'
+
+def split_archive_members(text):
+    """(name, first_line, text) of each member of a document built by join_archive_members"""
+    members = []
+    for number, line in enumerate(text.split('\n'), 1):
+        match = ARCHIVE_BOUNDARY_PATTERN.fullmatch(line)
+        if match:
+            members.append((match.group(1), number + 1, []))
+        elif members:
+            members[-1][2].append(line)
+    return [(name, first_line, '\n'.join(lines)) for name, first_line, lines in members]
+
+def split_archive_code(text):
+    """Split a ZIP submission's text into its code members and the rest
+    
+    Returns ([(first_line, text), ...] for the code members, joined prose of the others).
+    first_line is where a member starts in text, so fingerprint lines refer to the whole document.
+    """
+    code_parts = []
+    prose = []
+    for name, first_line, member_text in split_archive_members(text):
+        if is_code_file(name):
+            code_parts.append((first_line, member_text))
+        else:
+            prose.append(member_text)
+    return code_parts, '\n'.join(prose)
+
+def _extract_pdf_range(filepath, start, stop):
+    """Text of pages [start, stop) of a PDF, run in a pool process"""
+    return list(FileProcessor().iter_pdf_pages(filepath, start, stop))
+
+def _extract_archive_member(filepath, name):
+    """Text of one member of a ZIP archive, run in a pool process"""
+    return FileProcessor().extract_archive_member(filepath, name)
 
 class FileProcessor:
-    def __init__(self):
+    def __init__(self, pdf_parallel_pages=50, pdf_chunk_pages=25, pdf_workers=None, extraction_cache=None,
+                 archive_workers=None):
         self.allowed_extensions = {
-            'txt', 'pdf', 'doc', 'docx', 'py', 'java', 'cpp', 'c', 'js', 'html', 'css'
+            'txt', 'pdf', 'doc', 'docx', 'py', 'java', 'cpp', 'c', 'js', 'html', 'css', 'zip'
         }
         self.max_file_size = 16 * 1024 * 1024  # 16MB
+        
+        # ZIP submissions: limits checked against the central directory before anything is inflated
+        self.max_archive_members = 200
+        self.max_archive_size = 64 * 1024 * 1024  # total uncompressed
+        self.max_compression_ratio = 100
+        self.archive_workers = archive_workers
+        
+        # PDFs with more pages than this are split into page ranges parsed in parallel
+        self.pdf_parallel_pages = pdf_parallel_pages
+        self.pdf_chunk_pages = pdf_chunk_pages
+        self.pdf_workers = pdf_workers
+        
+        # Optional ExtractionCache so identical files are only parsed once
+        self.extraction_cache = extraction_cache
+        
+        # Uploads up to this size are extracted from memory while they are written to disk, but only
+        # types that just need decoding; parsing PDF, DOCX and ZIP would hold the GIL on the request
+        # thread, so those are left to the background worker
+        self.inline_extract_size = 2 * 1024 * 1024
+        self.inline_extract_types = {'txt', 'py', 'java', 'cpp', 'c', 'js', 'html', 'css'}
     
     def allowed_file(self, filename):
         """Check if file extension is allowed"""
@@ -24,6 +103,11 @@ class FileProcessor:
     
     def extract_text(self, filepath):
         """Extract text content from various file types"""
+        if self.extraction_cache is not None:
+            return self.extract_text_with_pages(filepath)[0]
+        return self._extract_text(filepath)
+    
+    def _extract_text(self, filepath):
         try:
             file_ext = self.get_file_type(filepath)
             
@@ -33,6 +117,8 @@ class FileProcessor:
                 return self.extract_from_pdf(filepath)
             elif file_ext in ['doc', 'docx']:
                 return self.extract_from_docx(filepath)
+            elif file_ext == 'zip':
+                return self.extract_from_zip(filepath)
             elif file_ext in ['py', 'java', 'cpp', 'c', 'js', 'html', 'css']:
                 return self.extract_from_code(filepath)
             else:
@@ -42,6 +128,69 @@ class FileProcessor:
             print(f"Error extracting text from {filepath}: {e}")
             return ""
     
+    def extract_text_with_pages(self, filepath, digest=None):
+        """Extract text plus the character offset each page starts at (None for unpaged formats)
+        
+        digest, the file's SHA-256 if the caller already has it, avoids hashing the file again.
+        """
+        if self.extraction_cache is None:
+            return self.extract_uncached(filepath)
+        
+        try:
+            digest = digest or self.file_digest(filepath)
+        except OSError as e:
+            print(f"Error extracting text from {filepath}: {e}")
+            return "", None
+        
+        cached = self.cached_extraction(filepath, digest)
+        if cached is not None:
+            return cached
+        
+        text, page_offsets = self.extract_uncached(filepath)
+        self.cache_extraction(filepath, digest, text, page_offsets)
+        return text, page_offsets
+    
+    def file_digest(self, filepath, chunk_size=1024 * 1024):
+        """SHA-256 hex digest of a file, read in chunks"""
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def extraction_key(self, filepath, digest):
+        """Cache key for a file's bytes; the extension matters because it picks the extractor"""
+        return hashlib.sha256(
+            f"{EXTRACTOR_VERSION}:{self.get_file_type(filepath)}:{digest}".encode('utf-8')
+        ).hexdigest()
+    
+    def cached_extraction(self, filepath, digest):
+        """Cached (text, page offsets) for a file with this digest, without opening the file"""
+        if self.extraction_cache is None or not digest:
+            return None
+        value = self.extraction_cache.get(self.extraction_key(filepath, digest))
+        if value is None:
+            return None
+        return value['text'], value['page_offsets']
+    
+    def cache_extraction(self, filepath, digest, text, page_offsets):
+        # Failed extractions return empty text and are retried rather than cached
+        if self.extraction_cache is None or not digest or not text:
+            return
+        self.extraction_cache.put(self.extraction_key(filepath, digest),
+                                  {'text': text, 'page_offsets': page_offsets})
+    
+    def extract_uncached(self, filepath):
+        """Extract text and page offsets by parsing the file"""
+        if self.get_file_type(filepath) != 'pdf':
+            return self._extract_text(filepath), None
+        
+        try:
+            return self.join_pages(self.extract_pdf_pages(filepath))
+        except Exception as e:
+            print(f"Error reading PDF: {e}")
+            return "", None
+    
     def extract_from_txt(self, filepath):
         """Extract text from plain text file"""
         try:
@@ -55,62 +204,351 @@ class FileProcessor:
     def extract_from_pdf(self, filepath):
         """Extract text from PDF file"""
         try:
-            text = ""
-            with open(filepath, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-            return text
+            return self.join_pages(self.extract_pdf_pages(filepath))[0]
         except Exception as e:
             print(f"Error reading PDF: {e}")
             return ""
     
+    def iter_pdf_pages(self, filepath, start=0, stop=None):
+        """Yield the text of each page in [start, stop) without building the whole document"""
+        with open(filepath, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            for page in pdf_reader.pages[start:stop]:
+                yield page.extract_text()
+    
+    def count_pdf_pages(self, filepath):
+        with open(filepath, 'rb') as file:
+            return len(PyPDF2.PdfReader(file).pages)
+    
+    def pdf_page_ranges(self, page_count):
+        """Split page_count pages into (start, stop) chunks, or one range if below the threshold"""
+        if page_count <= self.pdf_parallel_pages:
+            return [(0, page_count)]
+        return [(start, min(start + self.pdf_chunk_pages, page_count))
+                for start in range(0, page_count, self.pdf_chunk_pages)]
+    
+    def extract_pdf_pages(self, filepath):
+        """Text of every page of a PDF, parsing large files across a process pool"""
+        ranges = self.pdf_page_ranges(self.count_pdf_pages(filepath))
+        
+        # Pool processes are daemonic and cannot start their own pool; parse serially there
+        if len(ranges) == 1 or multiprocessing.current_process().daemon:
+            return list(self.iter_pdf_pages(filepath))
+        
+        starts, stops = zip(*ranges)
+        pages = []
+        with ProcessPoolExecutor(max_workers=self.pdf_workers) as executor:
+            for chunk in executor.map(_extract_pdf_range, [filepath] * len(ranges), starts, stops):
+                pages.extend(chunk)
+        return pages
+    
+    def join_pages(self, pages):
+        """Join page texts once, returning the text and the offset each page starts at"""
+        offsets = []
+        position = 0
+        for page in pages:
+            offsets.append(position)
+            position += len(page) + 1
+        return ''.join(page + '\n' for page in pages), offsets
+    
     def extract_from_docx(self, filepath):
         """Extract text from DOCX file"""
         try:
-            doc = docx.Document(filepath)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text
+            return ''.join(line + "\n" for line in self.iter_docx_lines(filepath))
         except Exception as e:
             print(f"Error reading DOCX: {e}")
             return ""
     
+    def iter_docx_lines(self, source):
+        """Yield each paragraph and table row of a DOCX path or file object, in document order
+        
+        word/document.xml is parsed incrementally and finished elements are discarded, so memory
+        stays bounded by the largest paragraph or table rather than the whole document.
+        Table rows come out as their cells joined by tabs.
+        """
+        w = WORD_NAMESPACE
+        with zipfile.ZipFile(source) as archive, archive.open('word/document.xml') as document:
+            body = None
+            runs = []   # text of the paragraph being read
+            rows = []   # cells of each open table row, innermost last
+            cells = []  # paragraphs of each open table cell, innermost last
+            
+            for event, element in ET.iterparse(document, events=('start', 'end')):
+                tag = element.tag
+                if event == 'start':
+                    if tag == w + 'body':
+                        body = element
+                    elif tag == w + 'tr':
+                        rows.append([])
+                    elif tag == w + 'tc':
+                        cells.append([])
+                    continue
+                
+                if tag == w + 't':
+                    runs.append(element.text or '')
+                elif tag == w + 'tab':
+                    runs.append('\t')
+                elif tag in (w + 'br', w + 'cr'):
+                    runs.append('\n')
+                elif tag == w + 'p':
+                    line = ''.join(runs)
+                    runs = []
+                    if cells:
+                        cells[-1].append(line)
+                    else:
+                        yield line
+                elif tag == w + 'tc':
+                    rows[-1].append(' '.join(line for line in cells.pop() if line))
+                elif tag == w + 'tr':
+                    line = '\t'.join(rows.pop())
+                    if cells:
+                        # A table nested in a cell becomes part of that cell's text
+                        cells[-1].append(line)
+                    else:
+                        yield line
+                else:
+                    continue
+                
+                # Everything read so far has been emitted; drop it from the tree
+                if not cells and body is not None and tag in (w + 'p', w + 'tr'):
+                    body.clear()
+    
     def extract_from_code(self, filepath):
         """Extract text from code files"""
         try:
             with open(filepath, 'r', encoding='utf-8') as file:
                 content = file.read()
-                
-            # Remove comments for better plagiarism detection
-            file_ext = self.get_file_type(filepath)
-            
-            if file_ext in ['py']:
-                # Remove Python comments
-                lines = content.split('\n')
-                cleaned_lines = []
-                for line in lines:
-                    # Remove inline comments
-                    if '#' in line:
-                        line = line[:line.index('#')]
-                    cleaned_lines.append(line)
-                content = '\n'.join(cleaned_lines)
-                
-            elif file_ext in ['java', 'cpp', 'c', 'js']:
-                # Remove C-style comments
-                import re
-                # Remove single line comments
-                content = re.sub(r'//.*', '', content)
-                # Remove multi-line comments
-                content = re.sub(r'/\*.*?\*/', '', content, flags=re.DOTALL)
             
-            return content
+            return self.strip_comments(content, self.get_file_type(filepath))
             
         except Exception as e:
             print(f"Error reading code file: {e}")
             return ""
     
+    def extract_from_zip(self, filepath):
+        """Combined text of every supported file in a ZIP archive, one section per member"""
+        try:
+            names = self.archive_members(filepath)
+            
+            # Members are inflated straight from the archive; pool processes parse them serially
+            if len(names) <= 1 or multiprocessing.current_process().daemon:
+                texts = [self.extract_archive_member(filepath, name) for name in names]
+            else:
+                with ProcessPoolExecutor(max_workers=self.archive_workers) as executor:
+                    texts = list(executor.map(_extract_archive_member, [filepath] * len(names), names))
+            return self.join_archive_members(names, texts)
+        except Exception as e:
+            print(f"Error reading ZIP archive: {e}")
+            return ""
+    
+    def archive_members(self, source):
+        """Names of the members of a ZIP path or file object that will be extracted, in archive order
+        
+        Raises ValueError if the archive breaks the member count, size or compression ratio limits.
+        Directories, nested archives, hidden and metadata files and unsupported types are skipped.
+        """
+        with zipfile.ZipFile(source) as archive:
+            members = [info for info in archive.infolist() if self.is_archive_member_supported(info)]
+        
+        if len(members) > self.max_archive_members:
+            raise ValueError(f"Archive has more than {self.max_archive_members} files")
+        
+        total_size = 0
+        for info in members:
+            if info.file_size > self.max_file_size:
+                raise ValueError(f"{info.filename} exceeds the maximum file size of {self.max_file_size/1024/1024}MB")
+            # Tiny members compress unpredictably; only large, highly compressed ones look like bombs
+            if info.file_size > 64 * 1024 and info.file_size > info.compress_size * self.max_compression_ratio:
+                raise ValueError(f"{info.filename} is compressed more than {self.max_compression_ratio}:1")
+            total_size += info.file_size
+        if total_size > self.max_archive_size:
+            raise ValueError(f"Archive contents exceed {self.max_archive_size/1024/1024}MB uncompressed")
+        
+        return [info.filename for info in members]
+    
+    def is_archive_member_supported(self, info):
+        if info.is_dir() or info.flag_bits & 0x1:  # directories and encrypted members
+            return False
+        parts = info.filename.replace('\\', '/').split('/')
+        if parts[0] == '__MACOSX' or any(part.startswith('.') for part in parts):
+            return False
+        file_ext = self.get_file_type(parts[-1])
+        return file_ext in self.allowed_extensions and file_ext != 'zip'
+    
+    def extract_archive_member(self, filepath, name):
+        """Text of one member of the ZIP archive at filepath"""
+        with zipfile.ZipFile(filepath) as archive:
+            return self.extract_from_archive(archive, name)
+    
+    def extract_from_archive(self, archive, name):
+        """Text of one member of an open ZipFile, inflated into memory rather than unpacked to disk
+        
+        ZipFile serialises reads of its underlying file, so threads may share one archive.
+        """
+        # zipfile stops at the declared size, which archive_members has already bounded
+        with archive.open(name) as member:
+            data = member.read(self.max_file_size + 1)
+        if len(data) > self.max_file_size:
+            raise ValueError(f"{name} exceeds the maximum file size")
+        return self.extract_text_with_pages_from_stream(data, name)[0]
+    
+    def join_archive_members(self, names, texts):
+        """One document with a boundary line before each member's text
+        
+        Member lines that look like a boundary are indented by a space, so a member cannot
+        pass the text after such a line off as another member, e.g. prose as a .py file.
+        """
+        sections = []
+        for name, text in zip(names, texts):
+            if text and '=====' in text:
+                text = '\n'.join(' ' + line if ARCHIVE_BOUNDARY_PATTERN.fullmatch(line) else line
+                                 for line in text.split('\n'))
+            if text and not text.endswith('\n'):
+                text += '\n'
+            name = ' '.join(name.splitlines())
+            sections.append(ARCHIVE_BOUNDARY.format(name) + '\n' + text)
+        return '\n'.join(sections)
+    
+    def sniff_file_type(self, header, declared_type):
+        """Real file type from the first bytes of an upload, or None if it is not one we accept"""
+        if header.startswith(PDF_MAGIC):
+            return 'pdf'
+        if header.startswith(ZIP_MAGIC):
+            return declared_type if declared_type in ('doc', 'docx', 'zip') else None
+        if header.startswith(OLE_MAGIC):
+            return declared_type if declared_type in ('doc', 'docx') else None
+        if b'\x00' in header:
+            return None
+        # Plain text: the extension still decides between prose and the code extractors
+        if declared_type == 'zip':
+            return None
+        if declared_type in ('pdf', 'doc', 'docx'):
+            return 'txt'
+        return declared_type
+    
+    def ingest_upload(self, stream, filename, blob_store, extract=False):
+        """Store an upload in one pass, hashing, size-checking and sniffing it as it is written
+        
+        Returns (blob, None) with the blob's path, digest, size and file_type, or (None, error).
+        With extract, text and code uploads up to inline_extract_size also get text and
+        page_offsets, decoded from memory instead of being read back from disk.
+        """
+        declared_type = self.get_file_type(filename)
+        writer = blob_store.writer()
+        file_type = None
+        buffered = [] if extract else None
+        try:
+            for chunk in iter(lambda: stream.read(blob_store.chunk_size), b''):
+                if writer.size == 0:
+                    file_type = self.sniff_file_type(chunk, declared_type)
+                    if file_type is None:
+                        writer.abort()
+                        return None, f"File content does not match an allowed type for .{declared_type} files"
+                    if file_type not in self.inline_extract_types:
+                        buffered = None
+                if writer.size + len(chunk) > self.max_file_size:
+                    writer.abort()
+                    return None, f"File size exceeds maximum limit of {self.max_file_size/1024/1024}MB"
+                writer.write(chunk)
+                if buffered is not None and writer.size <= self.inline_extract_size:
+                    buffered.append(chunk)
+                else:
+                    buffered = None
+        except BaseException:
+            writer.abort()
+            raise
+        
+        if writer.size == 0:
+            writer.abort()
+            return None, "File is empty"
+        
+        if file_type == 'zip':
+            # Only the central directory is read; a rejected archive never reaches the store
+            try:
+                writer.file.flush()
+                if not self.archive_members(writer.temp_path):
+                    writer.abort()
+                    return None, "Archive contains no supported files"
+            except (ValueError, zipfile.BadZipFile) as e:
+                writer.abort()
+                return None, f"Invalid archive: {e}"
+        
+        blob = writer.commit(file_type)
+        if buffered is not None:
+            blob['text'], blob['page_offsets'] = self.extract_text_with_pages_from_stream(
+                b''.join(buffered), f"upload.{file_type}"
+            )
+            self.cache_extraction(blob['path'], blob['digest'], blob['text'], blob['page_offsets'])
+        
+        blob['file_type'] = file_type
+        return blob, None
+    
+    def strip_comments(self, content, file_ext):
+        """Remove comments for better plagiarism detection"""
+        if file_ext in ['py']:
+            # Remove Python comments
+            lines = content.split('\n')
+            cleaned_lines = []
+            for line in lines:
+                # Remove inline comments
+                if '#' in line:
+                    line = line[:line.index('#')]
+                cleaned_lines.append(line)
+            content = '\n'.join(cleaned_lines)
+            
+        elif file_ext in ['java', 'cpp', 'c', 'js']:
+            # Remove C-style comments
+            import re
+            # Remove single line comments
+            content = re.sub(r'//.*', '', content)
+            # Remove multi-line comments, keeping their line breaks so line numbers still match
+            content = re.sub(r'/\*.*?\*/', lambda m: '\n' * m.group(0).count('\n'),
+                             content, flags=re.DOTALL)
+        
+        return content
+    
+    def extract_text_from_stream(self, stream, filename):
+        """Extract text from bytes, a memoryview or a file-like object, picking the extractor by filename"""
+        return self.extract_text_with_pages_from_stream(stream, filename)[0]
+    
+    def extract_text_with_pages_from_stream(self, stream, filename):
+        """In-memory counterpart of extract_text_with_pages, for uploads that have not been reread from disk"""
+        if isinstance(stream, (bytes, bytearray, memoryview)):
+            stream = io.BytesIO(stream)
+        elif stream.seekable():
+            stream.seek(0)
+        
+        file_ext = self.get_file_type(filename)
+        try:
+            if file_ext == 'pdf':
+                return self.join_pages([page.extract_text() for page in PyPDF2.PdfReader(stream).pages])
+            elif file_ext in ['doc', 'docx']:
+                return ''.join(line + "\n" for line in self.iter_docx_lines(stream)), None
+            elif file_ext == 'zip':
+                # Uploads extracted inline are small, so their members are extracted by a thread pool
+                names = self.archive_members(stream)
+                with zipfile.ZipFile(stream) as archive, \
+                        ThreadPoolExecutor(max_workers=self.archive_workers) as executor:
+                    texts = list(executor.map(lambda name: self.extract_from_archive(archive, name), names))
+                return self.join_archive_members(names, texts), None
+            elif file_ext in ['py', 'java', 'cpp', 'c', 'js', 'html', 'css']:
+                return self.strip_comments(self.decode_text(stream.read(), fallback_encoding=None), file_ext), None
+            else:
+                return self.decode_text(stream.read()), None
+        except Exception as e:
+            print(f"Error extracting text from {filename}: {e}")
+            return "", None
+    
+    def decode_text(self, data, fallback_encoding='latin-1'):
+        """Decode like open() in text mode: UTF-8 first, with universal newlines"""
+        try:
+            text = bytes(data).decode('utf-8')
+        except UnicodeDecodeError:
+            if fallback_encoding is None:
+                raise
+            text = bytes(data).decode(fallback_encoding)
+        return text.replace('\r\n', '\n').replace('\r', '\n')
+    
     def validate_file(self, filepath):
         """Validate uploaded file"""
         if not os.path.exists(filepath):
@@ -0,0 +1,116 @@
+"""
+Durable SQLite-backed job queue for background submission processing
+"""
+
+import json
+import time
+
+class JobQueue:
+    def __init__(self, get_connection, max_attempts=3, retry_delay=5.0, lease_timeout=600.0):
+        self.get_connection = get_connection
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_timeout = lease_timeout
+
+    def create_tables(self, cursor):
+        """Create the jobs table on an open cursor"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued'
+                    CHECK (status IN ('queued', 'running', 'done', 'failed')),
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                locked_at REAL,
+                locked_by TEXT,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_jobs_status_available
+            ON jobs (status, available_at)
+        ''')
+
+    def enqueue(self, cursor, kind, payload):
+        """Add a job using the caller's cursor, so it commits with their transaction"""
+        cursor.execute('''
+            INSERT INTO jobs (kind, payload, available_at) VALUES (?, ?, ?)
+        ''', (kind, json.dumps(payload), time.time()))
+        return cursor.lastrowid
+
+    def claim(self, worker_id):
+        """Atomically lease the oldest available job, or return None"""
+        conn = self.get_connection()
+        try:
+            row = conn.execute('''
+                UPDATE jobs
+                SET status = 'running', attempts = attempts + 1, locked_at = ?, locked_by = ?
+                WHERE id = (
+                    SELECT id FROM jobs
+                    WHERE status = 'queued' AND available_at <= ?
+                    ORDER BY available_at, id
+                    LIMIT 1
+                )
+                RETURNING id, kind, payload, attempts
+            ''', (time.time(), worker_id, time.time())).fetchone()
+            conn.commit()
+        finally:
+            conn.close()
+
+        if row is None:
+            return None
+        return {
+            'id': row[0],
+            'kind': row[1],
+            'payload': json.loads(row[2]),
+            'attempts': row[3]
+        }
+
+    def complete(self, job_id):
+        self._execute('''
+            UPDATE jobs SET status = 'done', locked_at = NULL, locked_by = NULL, last_error = NULL
+            WHERE id = ?
+        ''', (job_id,))
+
+    def fail(self, job_id, attempts, error):
+        """Requeue a failed job with a delay, or mark it failed after max_attempts; True if final"""
+        final = attempts >= self.max_attempts
+        self._execute('''
+            UPDATE jobs
+            SET status = ?, available_at = ?, locked_at = NULL, locked_by = NULL, last_error = ?
+            WHERE id = ?
+        ''', ('failed' if final else 'queued', time.time() + self.retry_delay * attempts, str(error), job_id))
+        return final
+
+    def requeue_stale(self):
+        """Return jobs whose worker died mid-run to the queue; returns how many"""
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute('''
+                UPDATE jobs SET status = 'queued', locked_at = NULL, locked_by = NULL
+                WHERE status = 'running' AND locked_at < ?
+            ''', (time.time() - self.lease_timeout,))
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def counts(self):
+        conn = self.get_connection()
+        try:
+            rows = conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+            return {status: count for status, count in rows}
+        finally:
+            conn.close()
+
+    def _execute(self, sql, params):
+        conn = self.get_connection()
+        try:
+            conn.execute(sql, params)
+            conn.commit()
+        finally:
+            conn.close()
@@ -0,0 +1,348 @@
+"""
+Numbered schema migrations, recorded in a schema_version table and applied on startup
+"""
+
+import json
+import time
+from text_analysis import analyze
+
+class Migration:
+    """One schema change: upgrade(db_manager, cursor) runs in a single transaction, then an
+    optional Backfill rewrites existing rows in batches"""
+
+    def __init__(self, version, name, upgrade=None, backfill=None):
+        self.version = version
+        self.name = name
+        self.upgrade = upgrade
+        self.backfill = backfill
+
+class Backfill:
+    """Applies apply(db_manager, cursor, rows) to the rows of table matching where, in rowid order
+
+    Each batch is read, and passed through prepare(db_manager, rows) if given, before the write
+    lock is taken; only apply and recording the last rowid done run in the write transaction.
+    Other connections keep writing while a batch is prepared and an interrupted backfill resumes.
+    """
+
+    def __init__(self, table, where, apply, columns='*', batch_size=200, prepare=None):
+        self.table = table
+        self.where = where
+        self.apply = apply
+        self.columns = columns
+        self.batch_size = batch_size
+        self.prepare = prepare
+
+class MigrationRunner:
+    def __init__(self, db_manager, migrations=None, batch_pause=0.05):
+        self.db_manager = db_manager
+        self.migrations = sorted(migrations if migrations is not None else MIGRATIONS,
+                                 key=lambda migration: migration.version)
+        # Seconds to sleep between backfill batches so other writers get the lock
+        self.batch_pause = batch_pause
+
+    def create_tables(self, cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                backfilled_to INTEGER,
+                backfilled_at TIMESTAMP
+            )
+        ''')
+
+    def current_version(self):
+        conn = self.db_manager.get_connection()
+        try:
+            self.create_tables(conn.cursor())
+            row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+            return row[0] or 0
+        finally:
+            conn.close()
+
+    def migrate(self, backfill=True):
+        """Apply every migration newer than the database, then finish any pending backfills
+
+        Safe to run from several processes at once: each migration takes the write lock and
+        re-reads the version first, so it is applied exactly once. Returns the versions applied.
+        """
+        applied = []
+        for migration in self.migrations:
+            if self.apply(migration):
+                applied.append(migration.version)
+        if backfill:
+            for migration in self.migrations:
+                if migration.backfill is not None:
+                    self.run_backfill(migration)
+        return applied
+
+    def apply(self, migration):
+        conn = self.db_manager.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            self.create_tables(cursor)
+            cursor.execute('SELECT 1 FROM schema_version WHERE version = ?', (migration.version,))
+            if cursor.fetchone():
+                conn.rollback()
+                return False
+
+            if migration.upgrade is not None:
+                migration.upgrade(self.db_manager, cursor)
+            cursor.execute('''
+                INSERT INTO schema_version (version, name, backfilled_to) VALUES (?, ?, ?)
+            ''', (migration.version, migration.name, 0 if migration.backfill is not None else None))
+            conn.commit()
+            print(f"Applied migration {migration.version}: {migration.name}")
+            return True
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def run_backfill(self, migration):
+        """Run a migration's backfill to completion from where it last stopped; returns rows done"""
+        backfill = migration.backfill
+        done = 0
+        while True:
+            conn = self.db_manager.get_connection()
+            cursor = conn.cursor()
+            try:
+                start = self.backfill_position(cursor, migration)
+                if start is None:
+                    return done
+
+                # Read and prepare the batch before taking the write lock
+                cursor.execute(f'''
+                    SELECT rowid AS backfill_rowid, {backfill.columns} FROM {backfill.table}
+                    WHERE rowid > ? AND ({backfill.where})
+                    ORDER BY rowid
+                    LIMIT ?
+                ''', (start, backfill.batch_size))
+                rows = cursor.fetchall()
+                prepared = backfill.prepare(self.db_manager, rows) if backfill.prepare and rows else rows
+
+                cursor.execute('BEGIN IMMEDIATE')
+                if self.backfill_position(cursor, migration) != start:
+                    # Another process finished this batch in the meantime
+                    conn.rollback()
+                    continue
+                if rows:
+                    backfill.apply(self.db_manager, cursor, prepared)
+                    cursor.execute('UPDATE schema_version SET backfilled_to = ? WHERE version = ?',
+                                   (rows[-1]['backfill_rowid'], migration.version))
+                if len(rows) < backfill.batch_size:
+                    cursor.execute('UPDATE schema_version SET backfilled_at = CURRENT_TIMESTAMP WHERE version = ?',
+                                   (migration.version,))
+                conn.commit()
+                done += len(rows)
+                if len(rows) < backfill.batch_size:
+                    if done:
+                        print(f"Backfilled {done} rows for migration {migration.version}: {migration.name}")
+                    return done
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+            time.sleep(self.batch_pause)
+
+    def backfill_position(self, cursor, migration):
+        """The last rowid a backfill has done, or None once it is finished"""
+        cursor.execute('''
+            SELECT backfilled_to FROM schema_version
+            WHERE version = ? AND backfilled_at IS NULL
+        ''', (migration.version,))
+        row = cursor.fetchone()
+        return None if row is None else row[0] or 0
+
+def create_base_tables(db_manager, cursor):
+    # Users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            full_name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            user_type TEXT NOT NULL CHECK (user_type IN ('student', 'lecturer')),
+            student_id TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Assignments table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS assignments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT,
+            due_date DATE NOT NULL,
+            max_score INTEGER DEFAULT 100,
+            lecturer_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (lecturer_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Submissions table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS submissions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            assignment_id INTEGER NOT NULL,
+            student_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            content TEXT,
+            plagiarism_score REAL DEFAULT 0.0,
+            score INTEGER,
+            feedback TEXT,
+            submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            graded_at TIMESTAMP,
+            FOREIGN KEY (assignment_id) REFERENCES assignments (id),
+            FOREIGN KEY (student_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Plagiarism reports table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS plagiarism_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            submission_id INTEGER NOT NULL,
+            similarity_score REAL NOT NULL,
+            matched_content TEXT,
+            report_data TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (submission_id) REFERENCES submissions (id)
+        )
+    ''')
+
+# Migrations 2-6 use ensure_column and IF NOT EXISTS because databases created before
+# schema_version existed may already have some of their changes
+
+def add_similarity_indexes(db_manager, cursor):
+    db_manager.ensure_column(cursor, 'submissions', 'minhash', 'BLOB')
+    db_manager.ensure_column(cursor, 'submissions', 'analysis', 'TEXT')
+    db_manager.ensure_column(cursor, 'submissions', 'content_hash', 'TEXT')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_submissions_content_hash
+        ON submissions (content_hash)
+    ''')
+
+    # Peer similarity, near-duplicate and code fingerprint indexes fed by complete_submission
+    db_manager.similarity_index.create_tables(cursor)
+    db_manager.lsh_index.create_tables(cursor)
+    db_manager.fingerprint_index.create_tables(cursor)
+
+def add_report_versions(db_manager, cursor):
+    db_manager.ensure_column(cursor, 'plagiarism_reports', 'detector_version', 'TEXT')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_plagiarism_reports_submission
+        ON plagiarism_reports (submission_id)
+    ''')
+
+def add_background_scoring(db_manager, cursor):
+    db_manager.ensure_column(cursor, 'submissions', 'status', "TEXT DEFAULT 'scored'")
+    db_manager.ensure_column(cursor, 'submissions', 'page_offsets', 'TEXT')
+
+    # Background extraction and scoring jobs
+    db_manager.job_queue.create_tables(cursor)
+
+def add_blob_storage(db_manager, cursor):
+    db_manager.ensure_column(cursor, 'submissions', 'file_digest', 'TEXT')
+    db_manager.ensure_column(cursor, 'submissions', 'file_size', 'INTEGER')
+
+def add_dashboard_indexes(db_manager, cursor):
+    # Dashboard access paths: each filters on the leading column and reads rows already
+    # in the ORDER BY order; the last three also cover their queries without the table
+    db_manager.ensure_index(cursor, 'idx_submissions_student', 'submissions', 'student_id, submitted_at DESC')
+    db_manager.ensure_index(cursor, 'idx_submissions_assignment', 'submissions', 'assignment_id, submitted_at DESC')
+    db_manager.ensure_index(cursor, 'idx_submissions_submitted', 'submissions', 'submitted_at DESC')
+    db_manager.ensure_index(cursor, 'idx_assignments_lecturer', 'assignments', 'lecturer_id, created_at DESC')
+    db_manager.ensure_index(cursor, 'idx_assignments_due_date', 'assignments', 'due_date')
+    db_manager.ensure_index(cursor, 'idx_submissions_file_path', 'submissions', 'file_path, submitted_at')
+    db_manager.ensure_index(cursor, 'idx_submissions_plagiarism_score', 'submissions', 'plagiarism_score')
+
+def create_submission_texts(db_manager, cursor):
+    # Extracted text is read only when scoring and reporting, so it lives outside the submissions row
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS submission_texts (
+            submission_id INTEGER PRIMARY KEY,
+            content BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            FOREIGN KEY (submission_id) REFERENCES submissions (id)
+        )
+    ''')
+
+def move_submission_texts(db_manager, cursor, rows):
+    for row in rows:
+        db_manager.save_submission_text(cursor, row['id'], row['content'])
+    # The emptied column stays; dropping it would rewrite the whole table under one lock
+    cursor.executemany('UPDATE submissions SET content = NULL WHERE id = ?', [(row['id'],) for row in rows])
+
+def analyze_legacy_submissions(db_manager, rows):
+    # Tokenizing is the slow part of indexing, so it happens before the batch takes the write lock
+    return [(row, analyze(row['content'])) for row in rows]
+
+def index_legacy_submissions(db_manager, cursor, documents):
+    # Submissions scored before the peer indexes existed were never added to them
+    for row, document in documents:
+        db_manager.index_submission(cursor, row['id'], row['assignment_id'], document, row['filename'])
+
+def key_code_fingerprints(db_manager, cursor):
+    # Scoring jobs re-run after a crash used to insert a submission's fingerprints again
+    cursor.execute('''
+        DELETE FROM code_fingerprints WHERE rowid NOT IN (
+            SELECT MIN(rowid) FROM code_fingerprints
+            GROUP BY submission_id, hash, start_line, end_line
+        )
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_code_fingerprints_submission')
+    db_manager.fingerprint_index.create_tables(cursor)
+
+def create_detection_cache(db_manager, cursor):
+    # Persistent tier of DetectionCache, shared by the web process and the scoring workers
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS detection_cache (
+            key TEXT PRIMARY KEY,
+            version TEXT,
+            value TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def index_scored_plagiarism_scores(db_manager, cursor):
+    # Score statistics only read scored submissions
+    db_manager.ensure_index(cursor, 'idx_submissions_plagiarism_score', 'submissions', 'status, plagiarism_score')
+
+def trim_submission_analysis(db_manager, cursor, rows):
+    # Listing queries read past analysis to reach status, so it is kept to fixed-size counts
+    summaries = []
+    for row in rows:
+        summary = json.loads(row['analysis'])
+        summary.pop('sentence_breaks', None)
+        summaries.append((json.dumps(summary), row['id']))
+    cursor.executemany('UPDATE submissions SET analysis = ? WHERE id = ?', summaries)
+
+MIGRATIONS = [
+    Migration(1, 'Create users, assignments, submissions and reports', create_base_tables),
+    Migration(2, 'Add peer similarity, near-duplicate and code fingerprint indexes', add_similarity_indexes),
+    Migration(3, 'Record the detector version of stored reports', add_report_versions),
+    Migration(4, 'Add submission status and the background job queue', add_background_scoring),
+    Migration(5, 'Record upload digests and sizes', add_blob_storage),
+    Migration(6, 'Index dashboard query paths', add_dashboard_indexes),
+    Migration(7, 'Index submissions scored before the peer indexes existed', backfill=Backfill(
+        'submissions', "status = 'scored' AND analysis IS NULL AND content IS NOT NULL AND content != ''", index_legacy_submissions,
+        columns='id, assignment_id, filename, content', prepare=analyze_legacy_submissions
+    )),
+    Migration(8, 'Move submission text into compressed submission_texts', create_submission_texts,
+              backfill=Backfill('submissions', 'content IS NOT NULL', move_submission_texts,
+                                columns='id, content')),
+    Migration(9, 'Key code fingerprints by submission and position', key_code_fingerprints),
+    Migration(10, 'Create the persistent detection cache', create_detection_cache),
+    Migration(11, 'Index plagiarism scores by submission status', index_scored_plagiarism_scores),
+    Migration(12, 'Drop sentence offsets from stored submission analysis', backfill=Backfill(
+        'submissions', "analysis LIKE '%sentence_breaks%'", trim_submission_analysis, columns='id, analysis'
+    )),
+]
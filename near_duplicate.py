@@ -0,0 +1,151 @@
+"""
+MinHash signatures and an LSH banding index for near-duplicate submissions
+"""
+
+import hashlib
+import zlib
+import numpy as np
+from text_analysis import analyze
+
+MERSENNE_PRIME = (1 << 31) - 1
+
+class MinHasher:
+    def __init__(self, num_perm=128, shingle_size=3, seed=1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+
+        # Random universal hash functions h(x) = (a * x + b) mod p, one per permutation
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+        self.b = generator.randint(0, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+
+    def shingles(self, text):
+        """Word n-gram shingles of the preprocessed text"""
+        words = analyze(text).tokens
+        if len(words) < self.shingle_size:
+            return {' '.join(words)} if words else set()
+        return {
+            ' '.join(words[i:i + self.shingle_size])
+            for i in range(len(words) - self.shingle_size + 1)
+        }
+
+    def signature(self, text, block_size=8192):
+        """MinHash signature of text, or None if it has no shingles"""
+        shingles = self.shingles(text)
+        if not shingles:
+            return None
+
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode('utf-8')) for shingle in shingles),
+            dtype=np.uint64, count=len(shingles)
+        )
+
+        signature = np.full(self.num_perm, MERSENNE_PRIME, dtype=np.uint64)
+        for start in range(0, len(hashes), block_size):
+            block = hashes[start:start + block_size]
+            permuted = (self.a[:, None] * block[None, :] + self.b[:, None]) % MERSENNE_PRIME
+            signature = np.minimum(signature, permuted.min(axis=1))
+        return signature.astype(np.uint32)
+
+def signature_to_bytes(signature):
+    return signature.astype(np.uint32).tobytes()
+
+def signature_from_bytes(data):
+    return np.frombuffer(data, dtype=np.uint32)
+
+def estimate_jaccard(signature_a, signature_b):
+    """Fraction of agreeing MinHash slots, an unbiased estimate of Jaccard similarity"""
+    return float(np.mean(signature_a == signature_b))
+
+class LSHIndex:
+    def __init__(self, get_connection, num_perm=128, bands=32, max_candidates=500):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.get_connection = get_connection
+        self.minhasher = MinHasher(num_perm=num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_candidates = max_candidates
+
+    def create_tables(self, cursor):
+        """Create the bucket table on an open cursor"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS lsh_buckets (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                submission_id INTEGER NOT NULL,
+                PRIMARY KEY (band, bucket, submission_id)
+            ) WITHOUT ROWID
+        ''')
+
+    def signature(self, text):
+        return self.minhasher.signature(text)
+
+    def band_keys(self, signature):
+        """One 64-bit bucket key per band of the signature"""
+        keys = []
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            digest = hashlib.blake2b(chunk, digest_size=8).digest()
+            keys.append((band, int.from_bytes(digest, 'big', signed=True)))
+        return keys
+
+    def add(self, cursor, submission_id, signature):
+        """Insert a submission's buckets using the caller's cursor"""
+        cursor.executemany('''
+            INSERT OR IGNORE INTO lsh_buckets (band, bucket, submission_id)
+            VALUES (?, ?, ?)
+        ''', [(band, bucket, submission_id) for band, bucket in self.band_keys(signature)])
+
+    def remove(self, cursor, submission_id, signature):
+        """Delete the buckets signature put a submission in, using the caller's cursor"""
+        cursor.executemany('''
+            DELETE FROM lsh_buckets WHERE band = ? AND bucket = ? AND submission_id = ?
+        ''', [(band, bucket, submission_id) for band, bucket in self.band_keys(signature)])
+
+    def query(self, signature, threshold=0.5, exclude_submission_id=None, exclude_student_id=None):
+        """Submissions sharing a band with signature whose estimated Jaccard meets threshold
+
+        Submissions by exclude_student_id, in any assignment, are left out.
+        """
+        if signature is None:
+            return []
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        try:
+            candidates = set()
+            for band, bucket in self.band_keys(signature):
+                cursor.execute('''
+                    SELECT submission_id FROM lsh_buckets
+                    WHERE band = ? AND bucket = ?
+                    LIMIT ?
+                ''', (band, bucket, self.max_candidates))
+                candidates.update(row[0] for row in cursor.fetchall())
+                if len(candidates) >= self.max_candidates:
+                    break
+            candidates.discard(exclude_submission_id)
+            if not candidates:
+                return []
+
+            candidate_ids = list(candidates)
+            cursor.execute(f'''
+                SELECT id, assignment_id, minhash FROM submissions
+                WHERE id IN ({','.join('?' * len(candidate_ids))}) AND minhash IS NOT NULL
+                  AND student_id IS NOT ?
+            ''', candidate_ids + [exclude_student_id])
+
+            matches = []
+            for submission_id, assignment_id, minhash in cursor.fetchall():
+                jaccard = estimate_jaccard(signature, signature_from_bytes(minhash))
+                if jaccard >= threshold:
+                    matches.append({
+                        'submission_id': submission_id,
+                        'assignment_id': assignment_id,
+                        'jaccard': round(jaccard, 4)
+                    })
+            matches.sort(key=lambda match: match['jaccard'], reverse=True)
+            return matches
+        finally:
+            conn.close()
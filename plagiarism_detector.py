@@ -1,17 +1,59 @@
 import numpy as np
+from sklearn.base import clone
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.svm import SVC
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.model_selection import train_test_split
 import pickle
 import os
-import re
+import threading
 from datetime import datetime
 import hashlib
+from text_analysis import AnalyzedDocument, analyze, content_hash, preprocess_text
+from code_fingerprint import is_code_file
+from file_processor import is_archive_file, split_archive_code
+from result_cache import DetectionCache
+
+# Bump whenever scoring changes so stored reports are regenerated
+DETECTOR_VERSION = 1
+
+class DetectionResult:
+    """Everything detect_plagiarism computed for one text, reused to build its report"""
+    
+    def __init__(self, plagiarism_score=0.0, svm_probability=0.0, similarity_score=0.0,
+                 best_match=None, features=None, matches=None, document=None):
+        self.plagiarism_score = plagiarism_score
+        self.svm_probability = svm_probability
+        self.similarity_score = similarity_score
+        self.best_match = best_match
+        self.features = features
+        self.matches = matches or {'similar_submissions': [], 'code_matches': [], 'near_duplicates': []}
+        self.document = document
+    
+    def to_dict(self):
+        return {
+            'plagiarism_score': self.plagiarism_score,
+            'svm_probability': self.svm_probability,
+            'similarity_score': self.similarity_score,
+            'best_match': self.best_match,
+            'features': [float(value) for value in self.features] if self.features is not None else None,
+            'matches': self.matches
+        }
 
 class PlagiarismDetector:
-    def __init__(self, model_path='plagiarism_model.pkl'):
+    def __init__(self, model_path='plagiarism_model.pkl', fit_once=True, db_manager=None, cache_size=1024):
         self.model_path = model_path
+        self.fit_once = fit_once
+        
+        # Optional DatabaseManager whose indexes hold prior submissions
+        self.db_manager = db_manager
+        
+        # SVM and reference scores depend only on the text and model, so identical
+        # resubmissions reuse them; the SQLite tier lives next to the submissions
+        self.cache = DetectionCache(
+            max_entries=cache_size,
+            get_connection=db_manager.get_connection if db_manager is not None else None
+        )
         self.vectorizer = TfidfVectorizer(
             max_features=5000,
             stop_words='english',
@@ -22,41 +64,56 @@ class PlagiarismDetector:
         self.similarity_threshold = 0.3
         self.plagiarism_threshold = 30.0
         
+        # A near-duplicate peer scoring at least this cosine settles the peer score, so the
+        # inverted-index walk is skipped; any better peer could only add 1 - cutoff to it
+        self.near_duplicate_cutoff = 0.9
+        
         # Database of known texts for comparison
         self.reference_texts = []
+        
+        # TF-IDF matrix of reference_texts, fitted once and reused for every query.
+        # Rows are L2-normalised, so a dot product with a query vector is the cosine.
+        self.reference_matrix = None
+        self.corpus_version = 0
+        
+        # Content hash of each reference text -> its index, for the exact-duplicate fast path
+        self.reference_hashes = {}
+        self._index_lock = threading.Lock()
+        self._refit_lock = threading.Lock()
         self.load_or_create_model()
     
+    @property
+    def version(self):
+        """Identifies the scoring logic and reference corpus a report was produced with"""
+        return f"{DETECTOR_VERSION}.{self.corpus_version}"
+    
     def preprocess_text(self, text):
         """Clean and preprocess text for analysis"""
-        # Remove extra whitespace and normalize
-        text = re.sub(r'\s+', ' ', text.strip())
-        
-        # Remove special characters but keep basic punctuation
-        text = re.sub(r'[^\w\s.,!?;:]', '', text)
-        
-        # Convert to lowercase
-        text = text.lower()
-        
-        return text
+        return preprocess_text(text)
+    
+    def analyze(self, text):
+        """Tokenize text once into an AnalyzedDocument shared by every score"""
+        return analyze(text)
     
     def extract_features(self, text):
-        """Extract features from text for SVM classification"""
+        """Extract features from preprocessed text or an AnalyzedDocument for SVM classification"""
+        if isinstance(text, AnalyzedDocument):
+            document = text
+        else:
+            document = AnalyzedDocument.from_processed(text)
+        
         # Basic text statistics
-        word_count = len(text.split())
-        char_count = len(text)
-        sentence_count = len(re.split(r'[.!?]+', text))
-        avg_word_length = np.mean([len(word) for word in text.split()])
+        word_count = document.word_count
+        char_count = document.char_count
         
         # Vocabulary richness
-        unique_words = len(set(text.split()))
-        vocabulary_richness = unique_words / word_count if word_count > 0 else 0
+        vocabulary_richness = document.unique_word_count / word_count if word_count > 0 else 0
         
         # Punctuation density
-        punctuation_count = len(re.findall(r'[.,!?;:]', text))
-        punctuation_density = punctuation_count / char_count if char_count > 0 else 0
+        punctuation_density = document.punctuation_count / char_count if char_count > 0 else 0
         
         return np.array([
-            word_count, char_count, sentence_count, avg_word_length,
+            word_count, char_count, document.sentence_count, document.avg_word_length,
             vocabulary_richness, punctuation_density
         ])
     
@@ -119,6 +176,7 @@ class PlagiarismDetector:
         
         # Store reference texts for similarity comparison
         self.reference_texts = [self.preprocess_text(text) for text in texts]
+        self.refit_reference_index(save=False)
         
         # Save model
         self.save_model()
@@ -130,7 +188,9 @@ class PlagiarismDetector:
         model_data = {
             'svm_model': self.svm_model,
             'vectorizer': self.vectorizer,
-            'reference_texts': self.reference_texts
+            'reference_texts': self.reference_texts,
+            'reference_matrix': self.reference_matrix,
+            'corpus_version': self.corpus_version
         }
         
         with open(self.model_path, 'wb') as f:
@@ -144,6 +204,13 @@ class PlagiarismDetector:
                 self.svm_model = model_data['svm_model']
                 self.vectorizer = model_data['vectorizer']
                 self.reference_texts = model_data['reference_texts']
+                self.reference_matrix = model_data.get('reference_matrix')
+                self.corpus_version = model_data.get('corpus_version', 0)
+            self.reference_hashes = self._hash_references(self.reference_texts)
+            
+            # Models saved before the fit-once index carry an unfitted vectorizer
+            if self.fit_once and self.reference_matrix is None and self.reference_texts:
+                self.refit_reference_index(save=False)
             return True
         except FileNotFoundError:
             return False
@@ -154,13 +221,125 @@ class PlagiarismDetector:
             print("Training new plagiarism detection model...")
             self.train_model()
     
+    def refit_reference_index(self, background=False, save=True):
+        """Fit the vectorizer and reference matrix on the current reference corpus"""
+        if background:
+            thread = threading.Thread(
+                target=self.refit_reference_index, kwargs={'save': save}, daemon=True
+            )
+            thread.start()
+            return thread
+        
+        with self._refit_lock:
+            texts = list(self.reference_texts)
+            vectorizer = clone(self.vectorizer)
+            reference_matrix = vectorizer.fit_transform(texts) if texts else None
+            reference_hashes = self._hash_references(texts)
+            
+            # Swap together so readers never pair a vectorizer with a stale matrix
+            with self._index_lock:
+                self.vectorizer = vectorizer
+                self.reference_matrix = reference_matrix
+                self.reference_hashes = reference_hashes
+                self.corpus_version += 1
+            
+            # Cached reference matches were computed against the old corpus
+            self.cache.clear()
+            self.cache.prune(self.version)
+            
+            if save:
+                self.save_model()
+    
+    def _hash_references(self, texts):
+        hashes = {}
+        for index, text in enumerate(texts):
+            hashes.setdefault(content_hash(text), index)
+        return hashes
+    
+    def find_exact_duplicate(self, text, exclude_submission_id=None, exclude_student_id=None):
+        """Reference text or another student's stored submission with identical normalized content, or None"""
+        document = self.analyze(text)
+        
+        reference_index = self.reference_hashes.get(document.content_hash)
+        if reference_index is not None:
+            return dict(self._reference_match(1.0, reference_index), exact=True)
+        
+        if self.db_manager is None:
+            return None
+        
+        try:
+            submission = self.db_manager.find_submission_by_content_hash(
+                document.content_hash, exclude_submission_id=exclude_submission_id,
+                exclude_student_id=exclude_student_id
+            )
+        except Exception as e:
+            print(f"Error querying content hash index: {e}")
+            return None
+        
+        if submission:
+            return {
+                'source': 'submission',
+                'submission_id': submission['id'],
+                'assignment_id': submission['assignment_id'],
+                'score': 1.0,
+                'exact': True
+            }
+        return None
+    
     def calculate_similarity_score(self, text):
         """Calculate similarity with reference texts"""
-        if not self.reference_texts:
-            return 0.0
+        reference_match = self.find_reference_match(text)
+        return reference_match['score'] if reference_match else 0.0
+    
+    def calculate_similarity_scores(self, texts):
+        """Calculate similarity with reference texts for many texts in one sparse product"""
+        processed_texts = [self.analyze(text).processed_text for text in texts]
+        scores, _ = self._reference_similarities(processed_texts)
+        return scores
+    
+    def find_reference_match(self, text):
+        """Best-matching reference text and its cosine similarity, or None without references"""
+        scores, indices = self._reference_similarities([self.analyze(text).processed_text])
+        return self._reference_match(scores[0], indices[0])
+    
+    def _reference_match(self, score, index):
+        if index < 0:
+            return None
+        return {
+            'source': 'reference',
+            'reference_index': int(index),
+            'text': self.reference_texts[index],
+            'score': float(score)
+        }
+    
+    def _reference_similarities(self, processed_texts):
+        """Best cosine and its reference index for each preprocessed text (-1 when unscored)"""
+        scores = np.zeros(len(processed_texts))
+        indices = np.full(len(processed_texts), -1)
+        if not self.reference_texts or not processed_texts:
+            return scores, indices
         
-        processed_text = self.preprocess_text(text)
+        if not self.fit_once:
+            for position, processed_text in enumerate(processed_texts):
+                scores[position], indices[position] = self._refit_similarity_score(processed_text)
+            return scores, indices
+        
+        with self._index_lock:
+            vectorizer = self.vectorizer
+            reference_matrix = self.reference_matrix
+        
+        if reference_matrix is None:
+            return scores, indices
         
+        try:
+            query_matrix = vectorizer.transform(processed_texts)
+            similarities = (query_matrix @ reference_matrix.T).toarray()
+            return similarities.max(axis=1), similarities.argmax(axis=1)
+        except:
+            return scores, indices
+    
+    def _refit_similarity_score(self, processed_text):
+        """Calculate similarity by refitting the vectorizer on the corpus plus text"""
         # Combine with reference texts for vectorization
         all_texts = self.reference_texts + [processed_text]
         
@@ -169,45 +348,289 @@ class PlagiarismDetector:
             tfidf_matrix = self.vectorizer.fit_transform(all_texts)
             
             # Calculate similarity with each reference text
-            similarities = cosine_similarity(tfidf_matrix[-1:], tfidf_matrix[:-1])
-            max_similarity = np.max(similarities)
+            similarities = cosine_similarity(tfidf_matrix[-1:], tfidf_matrix[:-1])[0]
+            best_index = int(np.argmax(similarities))
             
-            return float(max_similarity)
+            return float(similarities[best_index]), best_index
         except:
-            return 0.0
+            return 0.0, -1
     
-    def detect_plagiarism(self, text):
-        """Main plagiarism detection function"""
-        if not text or len(text.strip()) < 10:
-            return 0.0
+    def find_matching_pages(self, text, page_offsets, best_match, limit=5):
+        """1-based pages of a paged document most similar to its best match"""
+        if not page_offsets or not best_match:
+            return []
         
-        processed_text = self.preprocess_text(text)
+        bounds = list(page_offsets) + [len(text)]
+        pages = [text[bounds[i]:bounds[i + 1]] for i in range(len(page_offsets))]
+        
+        if best_match['source'] == 'reference':
+            scores = self._reference_page_scores(pages, best_match['reference_index'])
+        elif best_match.get('submission_id') is not None and self.db_manager is not None:
+            submission_id = best_match['submission_id']
+            similarity_index = self.db_manager.similarity_index
+            scores = [similarity_index.score_submissions(page, [submission_id]).get(submission_id, 0.0)
+                      for page in pages]
+        else:
+            return []
+        
+        ranked = sorted(((score, number) for number, score in enumerate(scores, 1) if score > 0), reverse=True)
+        return [{'page': number, 'score': round(float(score), 4)} for score, number in ranked[:limit]]
+    
+    def _reference_page_scores(self, pages, reference_index):
+        with self._index_lock:
+            vectorizer = self.vectorizer
+            reference_matrix = self.reference_matrix
         
-        # Extract features for SVM
-        text_features = self.extract_features(processed_text)
+        if reference_matrix is None or not self.fit_once:
+            return []
+        
+        query_matrix = vectorizer.transform([self.analyze(page).processed_text for page in pages])
+        return (query_matrix @ reference_matrix[reference_index].T).toarray().ravel()
+    
+    def find_similar_submissions(self, text, assignment_id, k=5, exclude_submission_id=None,
+                                 exclude_student_id=None):
+        """Find the prior submissions to an assignment, other than the student's own, most similar to text"""
+        if self.db_manager is None or assignment_id is None:
+            return []
+        
+        try:
+            return self.db_manager.similarity_index.query(
+                assignment_id, text, k=k, exclude_submission_id=exclude_submission_id,
+                exclude_student_id=exclude_student_id
+            )
+        except Exception as e:
+            print(f"Error querying similarity index: {e}")
+            return []
+    
+    def find_near_duplicates(self, text, exclude_submission_id=None, threshold=0.5, exclude_student_id=None):
+        """Find near-identical stored submissions via MinHash LSH, then score only those"""
+        if self.db_manager is None:
+            return []
+        
+        try:
+            signature = self.db_manager.lsh_index.signature(text)
+            candidates = self.db_manager.lsh_index.query(
+                signature, threshold=threshold, exclude_submission_id=exclude_submission_id,
+                exclude_student_id=exclude_student_id
+            )
+            if not candidates:
+                return []
+            
+            scores = self.db_manager.similarity_index.score_submissions(
+                text, [candidate['submission_id'] for candidate in candidates]
+            )
+            for candidate in candidates:
+                candidate['score'] = scores.get(candidate['submission_id'], candidate['jaccard'])
+            return candidates
+        except Exception as e:
+            print(f"Error querying near-duplicate index: {e}")
+            return []
+    
+    def find_code_matches(self, text, assignment_id, k=5, exclude_submission_id=None, exclude_student_id=None):
+        """Find prior code submissions sharing winnowed fingerprints with text"""
+        if self.db_manager is None or assignment_id is None:
+            return []
+        
+        try:
+            return self.db_manager.fingerprint_index.query(
+                assignment_id, text, k=k, exclude_submission_id=exclude_submission_id,
+                exclude_student_id=exclude_student_id
+            )
+        except Exception as e:
+            print(f"Error querying fingerprint index: {e}")
+            return []
+    
+    def calculate_peer_similarity(self, text, assignment_id=None, submission_id=None, filename=None,
+                                  k=1, reference_match=None, student_id=None):
+        """Best similarity against references and stored submissions, the matches and the best one
+        
+        Submissions by student_id, such as their own earlier attempts, are never peer matches.
+        """
+        matches = {'similar_submissions': [], 'code_matches': [], 'near_duplicates': []}
+        document = self.analyze(text)
+        best_match = None
+        
+        # LSH runs first: a handful of bucket lookups that also shortlist the peer pass
+        matches['near_duplicates'] = self.find_near_duplicates(
+            document, exclude_submission_id=submission_id, exclude_student_id=student_id
+        )
+        
+        # Prose TF-IDF with English stop words is blind to copied code, so code is fingerprinted
+        code, prose = None, document
+        if is_archive_file(filename):
+            code_parts, prose_text = split_archive_code(document.text)
+            code = code_parts or None
+            prose = self.analyze(prose_text) if prose_text.strip() else None
+        elif is_code_file(filename):
+            code, prose = document, None
+        
+        if code is not None:
+            matches['code_matches'] = self.find_code_matches(
+                code, assignment_id, k=k, exclude_submission_id=submission_id, exclude_student_id=student_id
+            )
+        if prose is not None:
+            best_match = reference_match or self.find_reference_match(document)
+            peers = sorted((candidate for candidate in matches['near_duplicates']
+                            if candidate['assignment_id'] == assignment_id),
+                           key=lambda candidate: candidate['score'], reverse=True)
+            if prose is document and assignment_id is not None and peers and \
+                    peers[0]['score'] >= self.near_duplicate_cutoff:
+                # The near-copies are already scored with the exact cosine; reuse them
+                matches['similar_submissions'] = [
+                    {'submission_id': peer['submission_id'], 'score': peer['score']} for peer in peers[:k]
+                ]
+            else:
+                # Paraphrases share too few shingles for LSH, so only the full pass finds them
+                matches['similar_submissions'] = self.find_similar_submissions(
+                    prose, assignment_id, k=k, exclude_submission_id=submission_id,
+                    exclude_student_id=student_id
+                )
+        
+        for source, found in (('submission', matches['similar_submissions']),
+                              ('code', matches['code_matches']),
+                              ('near_duplicate', matches['near_duplicates'])):
+            if found and (best_match is None or found[0]['score'] > best_match['score']):
+                best_match = dict(found[0], source=source)
+        
+        similarity_score = best_match['score'] if best_match else 0.0
+        return similarity_score, matches, best_match
+    
+    def detect_plagiarism(self, text, assignment_id=None, submission_id=None, filename=None, top_k=5,
+                          student_id=None):
+        """Main plagiarism detection function, returning a DetectionResult"""
+        document = self.analyze(text or '')
+        if len(document.text.strip()) < 10:
+            return DetectionResult(document=document)
+        
+        # Whole-file copies cost one indexed lookup instead of a scoring run
+        duplicate = self.find_exact_duplicate(
+            document, exclude_submission_id=submission_id, exclude_student_id=student_id
+        )
+        if duplicate:
+            return DetectionResult(
+                plagiarism_score=100.0, similarity_score=1.0, best_match=duplicate, document=document
+            )
+        
+        # SVM probability, features and reference match, from the cache when possible
+        content_scores = self.score_content([document])[0]
+        svm_probability = content_scores['svm_probability']
+        
+        # Calculate similarity score against references and peer submissions
+        similarity_score, matches, best_match = self.calculate_peer_similarity(
+            document, assignment_id, submission_id, filename, k=top_k,
+            reference_match=content_scores['reference_match'], student_id=student_id
+        )
+        
+        return DetectionResult(
+            plagiarism_score=self.combine_scores(svm_probability, similarity_score),
+            svm_probability=svm_probability,
+            similarity_score=similarity_score,
+            best_match=best_match,
+            features=np.array(content_scores['features']),
+            matches=matches,
+            document=document
+        )
+    
+    def score_content(self, documents):
+        """Content-only scores for each document: SVM probability, features and reference match
+        
+        Cache misses are scored together with one predict_proba and one sparse product.
+        """
+        results = [None] * len(documents)
+        keys = [self.cache.make_key(document.processed_text, self.version) for document in documents]
+        
+        misses = []
+        for position, key in enumerate(keys):
+            results[position] = self.cache.get(key)
+            if results[position] is None:
+                misses.append(position)
+        if not misses:
+            return results
+        
+        features = np.array([self.extract_features(documents[position]) for position in misses])
         
-        # Get SVM prediction probability
         try:
-            svm_probability = self.svm_model.predict_proba([text_features])[0][1]
+            svm_probabilities = self.svm_model.predict_proba(features)[:, 1]
         except:
-            svm_probability = 0.0
+            svm_probabilities = np.zeros(len(misses))
+        
+        reference_scores, reference_indices = self._reference_similarities(
+            [documents[position].processed_text for position in misses]
+        )
+        
+        for offset, position in enumerate(misses):
+            results[position] = {
+                'svm_probability': float(svm_probabilities[offset]),
+                'features': [float(value) for value in features[offset]],
+                'reference_match': self._reference_match(reference_scores[offset], reference_indices[offset])
+            }
         
-        # Calculate similarity score
-        similarity_score = self.calculate_similarity_score(text)
+        # One transaction, and one fsync, for every miss in the batch
+        self.cache.put_many([(keys[position], results[position]) for position in misses], self.version)
         
-        # Combine scores (weighted average)
+        return results
+    
+    def combine_scores(self, svm_probability, similarity_score):
+        """Weighted average of the SVM probability and similarity, as a percentage"""
         final_score = (svm_probability * 0.6 + similarity_score * 0.4) * 100
         
         return min(final_score, 100.0)  # Cap at 100%
     
-    def get_detailed_report(self, text):
-        """Generate detailed plagiarism report"""
-        processed_text = self.preprocess_text(text)
-        plagiarism_score = self.detect_plagiarism(text)
+    def detect_plagiarism_batch(self, texts, assignment_ids=None, submission_ids=None, filenames=None,
+                                student_ids=None):
+        """Score many texts with one feature matrix, one predict_proba and one sparse product"""
+        count = len(texts)
+        assignment_ids = assignment_ids or [None] * count
+        submission_ids = submission_ids or [None] * count
+        filenames = filenames or [None] * count
+        student_ids = student_ids or [None] * count
         
-        # Extract features
-        features = self.extract_features(processed_text)
-        similarity_score = self.calculate_similarity_score(text)
+        scores = [0.0] * count
+        documents = [self.analyze(text) if text else None for text in texts]
+        valid = [i for i, document in enumerate(documents) if document and len(document.text.strip()) >= 10]
+        if not valid:
+            return scores
+        
+        duplicates = set()
+        for i in valid:
+            if self.find_exact_duplicate(documents[i], exclude_submission_id=submission_ids[i],
+                                         exclude_student_id=student_ids[i]):
+                scores[i] = 100.0
+                duplicates.add(i)
+        valid = [i for i in valid if i not in duplicates]
+        if not valid:
+            return scores
+        
+        content_scores = self.score_content([documents[i] for i in valid])
+        
+        for position, i in enumerate(valid):
+            svm_probability = content_scores[position]['svm_probability']
+            reference_match = content_scores[position]['reference_match']
+            if self.db_manager is not None or is_code_file(filenames[i]):
+                # Index lookups stay per text; they are cheap next to the model work above
+                similarity_score, _, _ = self.calculate_peer_similarity(
+                    documents[i], assignment_ids[i], submission_ids[i], filenames[i],
+                    reference_match=reference_match, student_id=student_ids[i]
+                )
+            else:
+                similarity_score = reference_match['score'] if reference_match else 0.0
+            scores[i] = self.combine_scores(svm_probability, similarity_score)
+        
+        return scores
+    
+    def get_detailed_report(self, text, assignment_id=None, submission_id=None, filename=None, page_offsets=None,
+                            student_id=None):
+        """Generate detailed plagiarism report from text or an existing DetectionResult
+
+        page_offsets, the character offset each page starts at, adds the pages closest to the best match.
+        """
+        if isinstance(text, DetectionResult):
+            result = text
+        else:
+            result = self.detect_plagiarism(text, assignment_id, submission_id, filename, student_id=student_id)
+        
+        document = result.document or self.analyze('')
+        plagiarism_score = result.plagiarism_score
         
         # Determine risk level
         if plagiarism_score < 15:
@@ -225,16 +648,25 @@ class PlagiarismDetector:
         
         report = {
             'plagiarism_score': round(plagiarism_score, 2),
-            'similarity_score': round(similarity_score * 100, 2),
+            'similarity_score': round(result.similarity_score * 100, 2),
+            'svm_probability': round(result.svm_probability * 100, 2),
             'risk_level': risk_level,
             'risk_color': risk_color,
-            'word_count': len(processed_text.split()),
-            'character_count': len(processed_text),
-            'unique_words': len(set(processed_text.split())),
+            'word_count': document.word_count,
+            'character_count': document.char_count,
+            'unique_words': document.unique_word_count,
+            'best_match': result.best_match,
+            'similar_submissions': result.matches['similar_submissions'],
+            'code_matches': result.matches['code_matches'],
+            'near_duplicates': result.matches['near_duplicates'],
             'recommendations': self.get_recommendations(plagiarism_score),
             'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
         
+        if page_offsets:
+            report['page_count'] = len(page_offsets)
+            report['matched_pages'] = self.find_matching_pages(document.text, page_offsets, result.best_match)
+        
         return report
     
     def get_recommendations(self, score):
@@ -262,9 +694,12 @@ class PlagiarismDetector:
                 "Verify all sources are properly cited."
             ]
     
-    def add_reference_text(self, text):
+    def add_reference_text(self, text, refit=True, background=False):
         """Add new reference text to the database"""
         processed_text = self.preprocess_text(text)
         if processed_text not in self.reference_texts:
             self.reference_texts.append(processed_text)
-            self.save_model()
+            if refit:
+                self.refit_reference_index(background=background)
+            else:
+                self.save_model()
@@ -0,0 +1,126 @@
+"""
+Two-tier cache of content-only detection work, keyed by normalized text and model version
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+class DetectionCache:
+    def __init__(self, max_entries=1024, get_connection=None):
+        self.max_entries = max_entries
+        self.get_connection = get_connection
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    def make_key(self, normalized_text, version):
+        """SHA-256 of the model version and the normalized text"""
+        digest = hashlib.sha256()
+        digest.update(str(version).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(normalized_text.encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Cached value for key from memory, then SQLite; None on a miss"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return self._entries[key]
+
+        value = self._load(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.persistent_hits += 1
+            self._remember(key, value)
+        return value
+
+    def put(self, key, value, version=None):
+        """Store value in both tiers"""
+        self.put_many([(key, value)], version)
+
+    def put_many(self, items, version=None):
+        """Store (key, value) pairs in both tiers, writing SQLite in one transaction"""
+        items = list(items)
+        if not items:
+            return
+        with self._lock:
+            for key, value in items:
+                self._remember(key, value)
+        self._store(items, version)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.persistent_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'memory_hits': self.memory_hits,
+                'persistent_hits': self.persistent_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.memory_hits + self.persistent_hits) / lookups, 4) if lookups else 0.0
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def prune(self, keep_version):
+        """Drop persistent entries written by any other model version"""
+        conn = self._connect()
+        if conn is None:
+            return
+        try:
+            conn.execute('DELETE FROM detection_cache WHERE version IS NOT ?', (str(keep_version),))
+            conn.commit()
+        except Exception as e:
+            print(f"Error pruning detection cache: {e}")
+        finally:
+            conn.close()
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _connect(self):
+        if self.get_connection is None:
+            return None
+        return self.get_connection()
+
+    def _load(self, key):
+        conn = self._connect()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute('SELECT value FROM detection_cache WHERE key = ?', (key,)).fetchone()
+            return json.loads(row[0]) if row else None
+        except Exception as e:
+            print(f"Error reading detection cache: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def _store(self, items, version):
+        conn = self._connect()
+        if conn is None:
+            return
+        version = None if version is None else str(version)
+        try:
+            conn.executemany('''
+                INSERT OR REPLACE INTO detection_cache (key, version, value)
+                VALUES (?, ?, ?)
+            ''', [(key, version, json.dumps(value)) for key, value in items])
+            conn.commit()
+        except Exception as e:
+            print(f"Error writing detection cache: {e}")
+        finally:
+            conn.close()
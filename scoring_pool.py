@@ -0,0 +1,157 @@
+"""
+Process pool that runs text extraction and plagiarism scoring outside the web process
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from database_manager import DatabaseManager
+from file_processor import FileProcessor
+from plagiarism_detector import PlagiarismDetector
+
+# Per-process state, set up once by _init_worker when a pool process starts
+_model_path = None
+_db_path = None
+_model_mtime = None
+_detector = None
+_file_processor = None
+
+def _init_worker(model_path, db_path, file_processor):
+    global _model_path, _db_path, _file_processor
+    _model_path = model_path
+    _db_path = db_path
+    _file_processor = file_processor
+    _load_detector()
+
+def _load_detector():
+    global _detector, _model_mtime
+    _model_mtime = _get_mtime(_model_path)
+    db_manager = DatabaseManager(_db_path) if _db_path else None
+    _detector = PlagiarismDetector(model_path=_model_path, db_manager=db_manager)
+
+def _get_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+def _current_detector():
+    """The preloaded detector, reloaded if the model file has been saved since"""
+    if _get_mtime(_model_path) != _model_mtime:
+        _load_detector()
+    return _detector
+
+def _extract_text_with_pages(filepath):
+    # The extraction cache is read and written by the calling process
+    return _file_processor.extract_uncached(filepath)
+
+def _count_pdf_pages(filepath):
+    return _file_processor.count_pdf_pages(filepath)
+
+def _extract_pdf_range(filepath, start, stop):
+    return list(_file_processor.iter_pdf_pages(filepath, start, stop))
+
+def _extract_archive_member(filepath, name):
+    return _file_processor.extract_archive_member(filepath, name)
+
+def _detect_plagiarism(text, assignment_id, submission_id, filename, page_offsets, student_id):
+    detector = _current_detector()
+    result = detector.detect_plagiarism(text, assignment_id, submission_id, filename, student_id=student_id)
+    report = detector.get_detailed_report(result, page_offsets=page_offsets)
+    return result, report, detector.version
+
+class ScoringPool:
+    def __init__(self, model_path='plagiarism_model.pkl', db_path=None, processes=None,
+                 extract_timeout=120.0, detect_timeout=120.0, max_tasks_per_child=200, context=None,
+                 file_processor=None):
+        self.model_path = model_path
+        self.db_path = db_path
+        self.processes = processes or os.cpu_count() or 1
+        self.extract_timeout = extract_timeout
+        self.detect_timeout = detect_timeout
+        self.max_tasks_per_child = max_tasks_per_child
+        self.context = multiprocessing.get_context(context)
+        
+        # Decides in this process how a large PDF is split into page ranges and
+        # owns the extraction cache; pool processes get a copy for parsing
+        self.file_processor = file_processor or FileProcessor()
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the pool processes once, each preloading the detector model"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = self.context.Pool(
+                    self.processes,
+                    initializer=_init_worker,
+                    initargs=(self.model_path, self.db_path, self.file_processor),
+                    maxtasksperchild=self.max_tasks_per_child
+                )
+            return self._pool
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+    def extract_text(self, filepath, timeout=None):
+        return self.extract_text_with_pages(filepath, timeout=timeout)[0]
+
+    def extract_text_with_pages(self, filepath, digest=None, timeout=None):
+        """Extract text and page offsets; large PDFs and ZIP members are spread across the pool"""
+        file_processor = self.file_processor
+        if file_processor.extraction_cache is not None:
+            digest = digest or file_processor.file_digest(filepath)
+            cached = file_processor.cached_extraction(filepath, digest)
+            if cached is not None:
+                return cached
+
+        text, page_offsets = self._extract(filepath, time.monotonic() + (timeout or self.extract_timeout))
+        file_processor.cache_extraction(filepath, digest, text, page_offsets)
+        return text, page_offsets
+
+    def _extract(self, filepath, deadline):
+        if self.file_processor.get_file_type(filepath) == 'pdf':
+            page_count = self._call([(_count_pdf_pages, (filepath,))], deadline)[0]
+            ranges = self.file_processor.pdf_page_ranges(page_count)
+            if len(ranges) > 1:
+                chunks = self._call([(_extract_pdf_range, (filepath, start, stop)) for start, stop in ranges],
+                                    deadline)
+                return self.file_processor.join_pages([page for chunk in chunks for page in chunk])
+
+        elif self.file_processor.get_file_type(filepath) == 'zip':
+            # Reading the central directory is cheap; inflating and parsing members is not
+            names = self.file_processor.archive_members(filepath)
+            texts = self._call([(_extract_archive_member, (filepath, name)) for name in names], deadline)
+            return self.file_processor.join_archive_members(names, texts), None
+
+        return self._call([(_extract_text_with_pages, (filepath,))], deadline)[0]
+
+    def detect_plagiarism(self, text, assignment_id=None, submission_id=None, filename=None,
+                          page_offsets=None, timeout=None, student_id=None):
+        """Score text in a pool process; returns (DetectionResult, report, detector version)"""
+        deadline = time.monotonic() + (timeout or self.detect_timeout)
+        return self._call([(_detect_plagiarism, (text, assignment_id, submission_id, filename, page_offsets,
+                                                 student_id))], deadline)[0]
+
+    def _call(self, calls, deadline):
+        """Run (func, args) calls in the pool and return their results once all finish by deadline"""
+        pool = self.start()
+        pending = [pool.apply_async(func, args) for func, args in calls]
+        try:
+            return [async_result.get(max(deadline - time.monotonic(), 0)) for async_result in pending]
+        except multiprocessing.TimeoutError:
+            # A hung task cannot be cancelled on its own, so replace the whole pool;
+            # calls still in flight on it time out too and their jobs are retried
+            self._terminate(pool)
+            raise TimeoutError(f"{calls[0][0].__name__.lstrip('_')} timed out")
+
+    def _terminate(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.terminate()
@@ -0,0 +1,211 @@
+"""
+Per-assignment inverted index used to compare a submission against its peers
+"""
+
+import heapq
+import math
+from collections import Counter, defaultdict
+from text_analysis import analyze
+
+class SimilarityIndex:
+    def __init__(self, get_connection, max_query_terms=50, candidate_limit=200,
+                 max_df_ratio=0.5, min_docs_for_pruning=20):
+        self.get_connection = get_connection
+        self.max_query_terms = max_query_terms
+        self.candidate_limit = candidate_limit
+        self.max_df_ratio = max_df_ratio
+        self.min_docs_for_pruning = min_docs_for_pruning
+
+    def create_tables(self, cursor):
+        """Create the index tables on an open cursor"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS similarity_assignments (
+                assignment_id INTEGER PRIMARY KEY,
+                doc_count INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS similarity_terms (
+                assignment_id INTEGER NOT NULL,
+                term TEXT NOT NULL,
+                df INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (assignment_id, term)
+            ) WITHOUT ROWID
+        ''')
+
+        # One row per (term, submission); weights are L2-normalised per submission
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS similarity_postings (
+                assignment_id INTEGER NOT NULL,
+                term TEXT NOT NULL,
+                submission_id INTEGER NOT NULL,
+                weight REAL NOT NULL,
+                PRIMARY KEY (assignment_id, term, submission_id)
+            ) WITHOUT ROWID
+        ''')
+
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_similarity_postings_submission
+            ON similarity_postings (submission_id, term, weight)
+        ''')
+
+    def term_weights(self, text):
+        """Sublinear, L2-normalised term frequencies for a raw text or AnalyzedDocument"""
+        counts = Counter(analyze(text).content_tokens)
+        weights = {term: 1.0 + math.log(count) for term, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        if norm == 0:
+            return {}
+        return {term: weight / norm for term, weight in weights.items()}
+
+    def add_document(self, cursor, assignment_id, submission_id, text):
+        """Index a submission using the caller's cursor so it shares their transaction"""
+        weights = self.term_weights(text)
+        if not weights:
+            return False
+
+        cursor.executemany('''
+            INSERT OR REPLACE INTO similarity_postings (assignment_id, term, submission_id, weight)
+            VALUES (?, ?, ?, ?)
+        ''', [(assignment_id, term, submission_id, weight) for term, weight in weights.items()])
+
+        cursor.executemany('''
+            INSERT INTO similarity_terms (assignment_id, term, df) VALUES (?, ?, 1)
+            ON CONFLICT (assignment_id, term) DO UPDATE SET df = df + 1
+        ''', [(assignment_id, term) for term in weights])
+
+        cursor.execute('''
+            INSERT INTO similarity_assignments (assignment_id, doc_count) VALUES (?, 1)
+            ON CONFLICT (assignment_id) DO UPDATE SET doc_count = doc_count + 1
+        ''', (assignment_id,))
+        return True
+
+    def remove_document(self, cursor, submission_id):
+        """Drop a submission's postings and its share of the term and document counts"""
+        cursor.execute(
+            'SELECT assignment_id, term FROM similarity_postings WHERE submission_id = ?',
+            (submission_id,)
+        )
+        postings = [tuple(row) for row in cursor.fetchall()]
+        if not postings:
+            return False
+
+        cursor.executemany('''
+            UPDATE similarity_terms SET df = df - 1 WHERE assignment_id = ? AND term = ?
+        ''', postings)
+        cursor.executemany('''
+            DELETE FROM similarity_terms WHERE assignment_id = ? AND term = ? AND df <= 0
+        ''', postings)
+        cursor.executemany('''
+            UPDATE similarity_assignments SET doc_count = doc_count - 1 WHERE assignment_id = ?
+        ''', [(assignment_id,) for assignment_id in {assignment_id for assignment_id, _ in postings}])
+        cursor.execute('DELETE FROM similarity_postings WHERE submission_id = ?', (submission_id,))
+        return True
+
+    def query(self, assignment_id, text, k=5, exclude_submission_id=None, exclude_student_id=None):
+        """Return the k indexed submissions most similar to text as dicts with scores
+
+        exclude_student_id leaves out the submitting student's own earlier submissions.
+        """
+        query_weights = self.term_weights(text)
+        if not query_weights:
+            return []
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(
+                'SELECT doc_count FROM similarity_assignments WHERE assignment_id = ?',
+                (assignment_id,)
+            )
+            row = cursor.fetchone()
+            doc_count = row[0] if row else 0
+            if doc_count == 0:
+                return []
+
+            document_frequencies = {}
+            for terms in _chunks(list(query_weights), 500):
+                cursor.execute(f'''
+                    SELECT term, df FROM similarity_terms
+                    WHERE assignment_id = ? AND term IN ({','.join('?' * len(terms))})
+                ''', [assignment_id] + terms)
+                document_frequencies.update((term, df) for term, df in cursor.fetchall())
+
+            # Only walk the postings of the most selective query terms; very common
+            # terms touch most of the assignment without telling submissions apart
+            max_df = doc_count
+            if doc_count >= self.min_docs_for_pruning:
+                max_df = max(1, int(doc_count * self.max_df_ratio))
+
+            ranked_terms = sorted(
+                (term for term, df in document_frequencies.items() if df <= max_df),
+                key=lambda term: query_weights[term] * math.log((doc_count + 1) / (document_frequencies[term] + 1)),
+                reverse=True
+            )[:self.max_query_terms]
+
+            partial_scores = defaultdict(float)
+            for term in ranked_terms:
+                cursor.execute('''
+                    SELECT submission_id, weight FROM similarity_postings
+                    WHERE assignment_id = ? AND term = ?
+                ''', (assignment_id, term))
+                for submission_id, weight in cursor.fetchall():
+                    partial_scores[submission_id] += query_weights[term] * weight
+
+            partial_scores.pop(exclude_submission_id, None)
+            if exclude_student_id is not None:
+                cursor.execute(
+                    'SELECT id FROM submissions WHERE student_id = ? AND assignment_id = ?',
+                    (exclude_student_id, assignment_id)
+                )
+                for row in cursor.fetchall():
+                    partial_scores.pop(row[0], None)
+            candidates = heapq.nlargest(
+                self.candidate_limit, partial_scores, key=partial_scores.get
+            )
+            if not candidates:
+                return []
+
+            # Re-rank the shortlist with the exact cosine over all of its terms
+            exact_scores = self._exact_scores(cursor, query_weights, candidates)
+            top = heapq.nlargest(k, exact_scores.items(), key=lambda item: item[1])
+            return [
+                {'submission_id': submission_id, 'score': round(min(score, 1.0), 4)}
+                for submission_id, score in top
+            ]
+        finally:
+            conn.close()
+
+    def score_submissions(self, text, submission_ids):
+        """Exact cosine between text and each of the given indexed submissions"""
+        query_weights = self.term_weights(text)
+        if not query_weights or not submission_ids:
+            return {}
+
+        conn = self.get_connection()
+        try:
+            exact_scores = self._exact_scores(conn.cursor(), query_weights, list(submission_ids))
+            return {
+                submission_id: round(min(score, 1.0), 4)
+                for submission_id, score in exact_scores.items()
+            }
+        finally:
+            conn.close()
+
+    def _exact_scores(self, cursor, query_weights, submission_ids):
+        exact_scores = defaultdict(float)
+        for chunk in _chunks(submission_ids, 500):
+            cursor.execute(f'''
+                SELECT submission_id, term, weight FROM similarity_postings
+                WHERE submission_id IN ({','.join('?' * len(chunk))})
+            ''', chunk)
+            for submission_id, term, weight in cursor.fetchall():
+                if term in query_weights:
+                    exact_scores[submission_id] += query_weights[term] * weight
+        return exact_scores
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
@@ -0,0 +1,70 @@
+"""
+In-memory publish/subscribe of submission status transitions for the status API and SSE stream
+"""
+
+import json
+import queue
+import threading
+from collections import OrderedDict
+
+# Statuses after which a submission never changes again
+TERMINAL_STATUSES = ('scored', 'failed')
+
+class StatusBroker:
+    def __init__(self, max_tracked=10000):
+        self.max_tracked = max_tracked
+        self._subscribers = {}
+        self._latest = OrderedDict()
+        self._lock = threading.Lock()
+
+    def publish(self, submission_id, status, **data):
+        """Record a submission's new status and push it to every subscriber"""
+        event = dict(data, submission_id=submission_id, status=status)
+        with self._lock:
+            self._latest[submission_id] = event
+            self._latest.move_to_end(submission_id)
+            while len(self._latest) > self.max_tracked:
+                self._latest.popitem(last=False)
+            subscribers = list(self._subscribers.get(submission_id, ()))
+
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+    def latest(self, submission_id):
+        """Last event published for a submission, or None if this process has not seen one"""
+        with self._lock:
+            return self._latest.get(submission_id)
+
+    def subscribe(self, submission_id):
+        subscriber = queue.Queue()
+        with self._lock:
+            self._subscribers.setdefault(submission_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, submission_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(submission_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[submission_id]
+
+    def stream(self, submission_id, current, keepalive=15.0):
+        """Yield SSE messages: the current status, then each transition until a terminal one"""
+        subscriber = self.subscribe(submission_id)
+        try:
+            # An event published between reading current and subscribing wins
+            event = self.latest(submission_id) or current
+            yield format_sse(event)
+            while event['status'] not in TERMINAL_STATUSES:
+                try:
+                    event = subscriber.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield format_sse(event)
+        finally:
+            self.unsubscribe(submission_id, subscriber)
+
+def format_sse(event):
+    return f"event: status\ndata: {json.dumps(event)}\n\n"
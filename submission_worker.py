@@ -0,0 +1,139 @@
+"""
+Background worker pool that extracts and scores queued submissions
+"""
+
+import threading
+import uuid
+
+class SubmissionWorker:
+    def __init__(self, db_manager, plagiarism_detector, file_processor, num_workers=2, poll_interval=2.0,
+                 scoring_pool=None, status_broker=None):
+        self.db_manager = db_manager
+        self.plagiarism_detector = plagiarism_detector
+        self.file_processor = file_processor
+        
+        # Optional ScoringPool; without one, extraction and scoring run on the worker thread
+        self.scoring_pool = scoring_pool
+
+        # Optional StatusBroker told about every status transition
+        self.status_broker = status_broker
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+
+        self.handlers = {
+            'score_submission': self.score_submission
+        }
+
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    def start(self):
+        """Start the worker threads once; later calls are no-ops"""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            if self.scoring_pool is not None:
+                self.scoring_pool.start()
+            self.db_manager.job_queue.requeue_stale()
+            for index in range(self.num_workers):
+                worker_id = f"worker-{index}-{uuid.uuid4().hex[:8]}"
+                thread = threading.Thread(target=self._run, args=(worker_id,), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        with self._lock:
+            self._stopping.set()
+            self._wakeup.set()
+            for thread in self._threads:
+                thread.join(timeout)
+            self._threads = []
+            if self.scoring_pool is not None:
+                self.scoring_pool.close()
+
+    def notify(self):
+        """Wake idle workers after a job has been enqueued"""
+        self._wakeup.set()
+
+    def process_next(self, worker_id='inline'):
+        """Claim and run one job; returns False when the queue is empty"""
+        job_queue = self.db_manager.job_queue
+        job = job_queue.claim(worker_id)
+        if job is None:
+            return False
+
+        try:
+            self.handlers[job['kind']](job['payload'])
+            job_queue.complete(job['id'])
+        except Exception as e:
+            print(f"Error processing job {job['id']} ({job['kind']}): {e}")
+            if job_queue.fail(job['id'], job['attempts'], e):
+                self.on_job_failed(job)
+        return True
+
+    def on_job_failed(self, job):
+        """Record a job that will not be retried again"""
+        submission_id = job['payload'].get('submission_id')
+        if submission_id is not None:
+            self.db_manager.update_submission_status(submission_id, 'failed')
+            self.publish(submission_id, 'failed')
+
+    def score_submission(self, payload):
+        """Extract text from a stored upload, score it and mark the submission scored"""
+        submission_id = payload['submission_id']
+        submission = self.db_manager.get_submission(submission_id)
+        if submission is None:
+            return
+
+        content = self.db_manager.get_submission_text(submission_id)
+        if content:
+            # Extracted in memory during upload
+            page_offsets = submission['page_offsets']
+        else:
+            content, page_offsets = self.extract_text_with_pages(submission['file_path'], submission['file_digest'])
+        self.db_manager.update_submission_status(submission_id, 'extracted')
+        self.publish(submission_id, 'extracted')
+
+        result, report, version = self.detect_plagiarism(
+            content, submission['assignment_id'], submission_id, submission['filename'], page_offsets,
+            student_id=submission['student_id']
+        )
+
+        self.db_manager.complete_submission(
+            submission_id, content, result.plagiarism_score, result.document, page_offsets
+        )
+        self.db_manager.save_plagiarism_report(submission_id, report, version)
+        self.publish(submission_id, 'scored', plagiarism_score=round(result.plagiarism_score, 2))
+
+    def publish(self, submission_id, status, **data):
+        if self.status_broker is not None:
+            self.status_broker.publish(submission_id, status, **data)
+
+    def extract_text_with_pages(self, filepath, digest=None):
+        if self.scoring_pool is not None:
+            return self.scoring_pool.extract_text_with_pages(filepath, digest)
+        return self.file_processor.extract_text_with_pages(filepath, digest)
+
+    def detect_plagiarism(self, text, assignment_id, submission_id, filename, page_offsets=None, student_id=None):
+        """Returns (DetectionResult, report, detector version)"""
+        if self.scoring_pool is not None:
+            return self.scoring_pool.detect_plagiarism(text, assignment_id, submission_id, filename, page_offsets,
+                                                       student_id=student_id)
+
+        detector = self.plagiarism_detector
+        result = detector.detect_plagiarism(detector.analyze(text), assignment_id, submission_id, filename,
+                                            student_id=student_id)
+        return result, detector.get_detailed_report(result, page_offsets=page_offsets), detector.version
+
+    def _run(self, worker_id):
+        while not self._stopping.is_set():
+            try:
+                if self.process_next(worker_id):
+                    continue
+            except Exception as e:
+                print(f"Error in submission worker {worker_id}: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
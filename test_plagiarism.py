@@ -4,8 +4,36 @@ Test script for the plagiarism detection system
 """
 
 from plagiarism_detector import PlagiarismDetector
+import json
+import os
+import tempfile
 import time
 
+def write_pdf(path, pages):
+    """Write a minimal PDF with one line of Helvetica text per page"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1')
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    data += ''.join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, 'wb') as f:
+        f.write(data)
+
 def test_plagiarism_detection():
     """Test the plagiarism detection functionality"""
     print("Testing Plagiarism Detection System")
@@ -62,10 +90,11 @@ def test_plagiarism_detection():
         print("-" * 30)
         
         start_time = time.time()
-        score = detector.detect_plagiarism(case['text'])
+        result = detector.detect_plagiarism(case['text'])
         end_time = time.time()
         
-        report = detector.get_detailed_report(case['text'])
+        score = result.plagiarism_score
+        report = detector.get_detailed_report(result)
         
         print(f"Plagiarism Score: {score:.2f}%")
         print(f"Risk Level: {report['risk_level']}")
@@ -98,6 +127,1063 @@ def test_file_processing():
         is_allowed = processor.allowed_file(filename)
         print(f"{filename}: {'✓ Allowed' if is_allowed else '✗ Not allowed'}")
 
+def test_fit_once_similarity():
+    """Scoring reuses the fitted reference index instead of refitting per call"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        detector = PlagiarismDetector(model_path=os.path.join(tmp_dir, 'model.pkl'))
+        vocabulary = detector.vectorizer.vocabulary_
+        version = detector.corpus_version
+        
+        copied = detector.calculate_similarity_score(
+            "Machine learning is a subset of artificial intelligence that focuses on algorithms."
+        )
+        detector.calculate_similarity_score("Something entirely unrelated about gardening.")
+        
+        assert detector.vectorizer.vocabulary_ is vocabulary
+        assert detector.corpus_version == version
+        assert copied > 0.99
+        
+        detector.add_reference_text("Gardening tips for growing tomatoes in small spaces.")
+        assert detector.corpus_version == version + 1
+        assert detector.calculate_similarity_score("gardening tips for growing tomatoes in small spaces") > 0.99
+        
+        # The refitted index is persisted with the model
+        reloaded = PlagiarismDetector(model_path=os.path.join(tmp_dir, 'model.pkl'))
+        assert reloaded.corpus_version == detector.corpus_version
+        assert reloaded.reference_matrix.shape == detector.reference_matrix.shape
+
+def test_peer_similarity_index():
+    """Submissions to the same assignment are compared against each other"""
+    from database_manager import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_manager = DatabaseManager(os.path.join(tmp_dir, 'test.db'))
+        db_manager.init_database()
+        assignment_id = db_manager.create_assignment('Essay', '', '2099-01-01', 100, 1)
+        other_assignment_id = db_manager.create_assignment('Other', '', '2099-01-01', 100, 1)
+        
+        essay = ("Photosynthesis converts light energy into chemical energy stored in glucose. "
+                 "Chlorophyll in the chloroplasts absorbs red and blue wavelengths.")
+        first_id = db_manager.create_submission(assignment_id, 2, 'a.txt', 'a.txt', 0.0, essay)
+        db_manager.create_submission(assignment_id, 2, 'b.txt', 'b.txt', 0.0,
+                                     "Volcanoes form where tectonic plates diverge or subduct.")
+        db_manager.create_submission(other_assignment_id, 2, 'c.txt', 'c.txt', 0.0, essay)
+        
+        matches = db_manager.similarity_index.query(assignment_id, essay, k=5)
+        assert matches[0]['submission_id'] == first_id
+        assert matches[0]['score'] > 0.99
+        assert all(match['score'] < 0.5 for match in matches[1:])
+        
+        detector = PlagiarismDetector(model_path=os.path.join(tmp_dir, 'model.pkl'), db_manager=db_manager)
+        peers = detector.find_similar_submissions(essay, assignment_id, exclude_submission_id=first_id)
+        assert first_id not in [match['submission_id'] for match in peers]
+        standalone = PlagiarismDetector(model_path=os.path.join(tmp_dir, 'model.pkl'))
+        peer_result = detector.detect_plagiarism(essay, assignment_id)
+        assert peer_result.plagiarism_score > standalone.detect_plagiarism(essay).plagiarism_score
+        assert peer_result.best_match['source'] in ('submission', 'near_duplicate')
+        
+        # Rebuilding in batches leaves the same index behind
+        tables = ['similarity_assignments', 'similarity_terms', 'similarity_postings', 'lsh_buckets']
+        def snapshot():
+            conn = db_manager.get_connection()
+            rows = {table: sorted(tuple(row) for row in conn.execute(f'SELECT * FROM {table}')) for table in tables}
+            conn.close()
+            return rows
+        before = snapshot()
+        assert db_manager.rebuild_submission_indexes(batch_size=2) == 3
+        assert snapshot() == before
+
+def test_peer_matches_skip_own_submissions():
+    """A student's earlier attempts at an assignment are not peer matches for their resubmission"""
+    from database_manager import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_manager = DatabaseManager(os.path.join(tmp_dir, 'test.db'))
+        db_manager.init_database()
+        assignment_id = db_manager.create_assignment('Essay', '', '2099-01-01', 100, 1)
+        
+        draft = ("Plate tectonics explains how continents drift over the mantle. "
+                 "Subduction zones recycle oceanic crust and feed volcanic arcs.")
+        draft_id = db_manager.create_submission(assignment_id, 2, 'draft.txt', 'draft.txt', 0.0, draft)
+        final = draft.replace("feed volcanic arcs", "build volcanic island arcs")
+        
+        detector = PlagiarismDetector(model_path=os.path.join(tmp_dir, 'model.pkl'), db_manager=db_manager)
+        assert detector.find_similar_submissions(final, assignment_id, exclude_student_id=2) == []
+        
+        copied_id = db_manager.create_submission(assignment_id, 3, 'copy.txt', 'copy.txt', 0.0, draft)
+        peers = detector.find_similar_submissions(final, assignment_id, exclude_student_id=2)
+        assert [match['submission_id'] for match in peers] == [copied_id]
+        
+        result = detector.detect_plagiarism(final, assignment_id, student_id=2)
+        assert draft_id not in [match['submission_id'] for match in result.matches['similar_submissions']]
+
+def test_near_duplicate_index():
+    """MinHash LSH finds lightly edited copies across assignments"""
+    from database_manager import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_manager = DatabaseManager(os.path.join(tmp_dir, 'test.db'))
+        db_manager.init_database()
+        first_assignment = db_manager.create_assignment('Essay', '', '2099-01-01', 100, 1)
+        second_assignment = db_manager.create_assignment('Resit', '', '2099-01-01', 100, 1)
+        
+        essay = " ".join(
+            f"Sentence number {i} discusses how the water cycle moves moisture between oceans and clouds."
+            for i in range(40)
+        )
+        original_id = db_manager.create_submission(first_assignment, 2, 'a.txt', 'a.txt', 0.0, essay)
+        db_manager.create_submission(first_assignment, 2, 'b.txt', 'b.txt', 0.0,
+                                     "A short unrelated note about medieval castle architecture and moats.")
+        
+        edited = essay.replace("Sentence number 7 ", "Sentence seven ")
+        detector = PlagiarismDetector(model_path=os.path.join(tmp_dir, 'model.pkl'), db_manager=db_manager)
+        duplicates = detector.find_near_duplicates(edited)
+        
+        assert [match['submission_id'] for match in duplicates] == [original_id]
+        assert duplicates[0]['jaccard'] > 0.8
+        assert duplicates[0]['score'] > 0.9
+        standalone = PlagiarismDetector(model_path=os.path.join(tmp_dir, 'model.pkl'))
+        edited_score = detector.detect_plagiarism(edited, second_assignment).plagiarism_score
+        assert edited_score > standalone.detect_plagiarism(edited).plagiarism_score
+
+        # A near-copy within the assignment settles the peer score without the postings walk
+        queries = []
+        query = db_manager.similarity_index.query
+        db_manager.similarity_index.query = lambda *args, **kwargs: queries.append(args) or query(*args, **kwargs)
+        result = detector.detect_plagiarism(edited, first_assignment)
+        assert queries == []
+        assert result.matches['similar_submissions'][0]['submission_id'] == original_id
+        
+        # The author's own resubmission is not a near-duplicate of their earlier one
+        assert detector.find_near_duplicates(edited, exclude_student_id=2) == []
+
+def test_code_fingerprint_index():
+    """Winnowing matches code with renamed identifiers and reports the copied lines"""
+    from database_manager import DatabaseManager
+    
+    original = """
+def bubble_sort(items):
+    n = len(items)
+    for i in range(n):
+        for j in range(0, n - i - 1):
+            if items[j] > items[j + 1]:
+                items[j], items[j + 1] = items[j + 1], items[j]
+    return items
+"""
+    renamed = """
+import sys
+
+def sort_values(values):
+    size = len(values)
+    for a in range(size):
+        for b in range(0, size - a - 1):
+            if values[b] > values[b + 1]:
+                values[b], values[b + 1] = values[b + 1], values[b]
+    return values
+"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_manager = DatabaseManager(os.path.join(tmp_dir, 'test.db'))
+        db_manager.init_database()
+        assignment_id = db_manager.create_assignment('Sorting', '', '2099-01-01', 100, 1)
+        original_id = db_manager.create_submission(assignment_id, 2, 'sort.py', 'sort.py', 0.0, original)
+        db_manager.create_submission(assignment_id, 2, 'hello.py', 'hello.py', 0.0, 'print("hello world")')
+        
+        matches = db_manager.fingerprint_index.query(assignment_id, renamed)
+        assert matches[0]['submission_id'] == original_id
+        assert matches[0]['score'] > 0.8
+        assert matches[0]['lines'][0][0] >= 4
+        assert matches[0]['matched_lines'][0][0] == 2
+
+        # Source files inside a ZIP are fingerprinted; only its other members reach the prose index
+        from file_processor import FileProcessor
+        archive_text = FileProcessor().join_archive_members(
+            ['README.txt', 'src/sort.py'], ["Sorting project for the algorithms module.", renamed]
+        )
+        zip_id = db_manager.create_submission(assignment_id, 3, 'project.zip', 'project.zip', 0.0, archive_text)
+        conn = db_manager.get_connection()
+        terms = {row[0] for row in conn.execute('SELECT term FROM similarity_postings WHERE submission_id = ?',
+                                                (zip_id,))}
+        conn.close()
+        assert 'algorithms' in terms and 'len' not in terms
+        assert zip_id in [match['submission_id'] for match in db_manager.fingerprint_index.query(assignment_id, original)]
+        
+        # A member cannot fake a boundary line to pass its prose off as code
+        from file_processor import split_archive_code
+        forged = FileProcessor().join_archive_members(['notes.txt'], ["Intro.\n===== evil.py =====\nCopied prose."])
+        assert split_archive_code(forged) == ([], "Intro.\n ===== evil.py =====\nCopied prose.\n")
+        
+        detector = PlagiarismDetector(model_path=os.path.join(tmp_dir, 'model.pkl'), db_manager=db_manager)
+        result = detector.detect_plagiarism(archive_text, assignment_id, filename='project.zip', student_id=3)
+        assert result.matches['code_matches'][0]['submission_id'] == original_id
+        # Matched lines count from the top of the combined archive text
+        assert result.matches['code_matches'][0]['lines'][0][0] >= 8
+
+def test_batch_matches_single_scoring():
+    """detect_plagiarism_batch returns the same scores, in order, as one-at-a-time calls"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        detector = PlagiarismDetector(model_path=os.path.join(tmp_dir, 'model.pkl'))
+        texts = [
+            "Neural networks are inspired by the biological neural networks of animal brains.",
+            "",
+            "The implementation of blockchain technology in educational systems presents unique opportunities.",
+            "short",
+            "Overfitting happens when a model learns the training data too well.",
+        ]
+        
+        batch_scores = detector.detect_plagiarism_batch(texts)
+        single_scores = [detector.detect_plagiarism(text).plagiarism_score for text in texts]
+        
+        assert len(batch_scores) == len(texts)
+        for batch_score, single_score in zip(batch_scores, single_scores):
+            assert abs(batch_score - single_score) < 1e-9
+
+def test_analyzed_document_reuse():
+    """One AnalyzedDocument feeds features and report fields identically to raw text"""
+    from text_analysis import AnalyzedDocument
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        detector = PlagiarismDetector(model_path=os.path.join(tmp_dir, 'model.pkl'))
+        text = "Deep learning changed vision. It also changed language!  Did it change audio?"
+        document = detector.analyze(text)
+        
+        assert isinstance(document, AnalyzedDocument)
+        assert detector.analyze(document) is document
+        assert list(detector.extract_features(document)) == list(detector.extract_features(document.processed_text))
+        assert detector.detect_plagiarism(document).plagiarism_score == detector.detect_plagiarism(text).plagiarism_score
+        assert document.sentence_count == 4
+        assert list(document.sentences())[1] == "it also changed language!"
+        
+        summary = json.loads(json.dumps(document.to_dict()))
+        report = detector.get_detailed_report(document)
+        assert summary['word_count'] == report['word_count'] == 12
+        assert summary['unique_word_count'] == report['unique_words']
+        assert 'sentence_breaks' not in summary
+
+def test_report_scores_once():
+    """get_detailed_report builds on one detection pass and carries its intermediates"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        detector = PlagiarismDetector(model_path=os.path.join(tmp_dir, 'model.pkl'))
+        calls = []
+        reference_similarities = detector._reference_similarities
+        detector._reference_similarities = lambda texts: calls.append(texts) or reference_similarities(texts)
+        
+        # Close to a reference text without being an exact copy, which would skip the scoring pass
+        reference = "Support vector machines are effective for classification and regression tasks."
+        text = reference + " They are widely used."
+        report = detector.get_detailed_report(text)
+        
+        assert len(calls) == 1
+        assert report['best_match']['source'] == 'reference'
+        assert report['best_match']['text'] == detector.preprocess_text(reference)
+        
+        result = detector.detect_plagiarism(text)
+        assert len(result.features) == 6
+        assert detector.get_detailed_report(result)['plagiarism_score'] == report['plagiarism_score']
+        assert len(calls) == 1  # served from the detection cache
+
+def test_report_persistence():
+    """Reports are stored as JSON with the detector version that produced them"""
+    from database_manager import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_manager = DatabaseManager(os.path.join(tmp_dir, 'test.db'))
+        db_manager.init_database()
+        detector = PlagiarismDetector(model_path=os.path.join(tmp_dir, 'model.pkl'), db_manager=db_manager)
+        
+        text = "Ensemble methods combine multiple models to improve prediction accuracy."
+        assignment_id = db_manager.create_assignment('Essay', '', '2099-01-01', 100, 1)
+        submission_id = db_manager.create_submission(assignment_id, 2, 'a.txt', 'a.txt', 0.0, text)
+        report = detector.get_detailed_report(text, assignment_id, submission_id)
+        
+        assert db_manager.get_plagiarism_report(submission_id) is None
+        db_manager.save_plagiarism_report(submission_id, report, detector.version)
+        db_manager.save_plagiarism_report(submission_id, report, detector.version)
+        
+        stored = db_manager.get_plagiarism_report(submission_id)
+        assert stored['report_data'] == json.loads(json.dumps(report))
+        assert stored['detector_version'] == detector.version
+        assert stored['matched_content'] == detector.preprocess_text(text)
+        
+        # Re-scoring drops the stored report, so it is not served with the old score
+        from admin_tools import AdminTools
+        admin = AdminTools.__new__(AdminTools)
+        admin.db_manager = db_manager
+        admin.plagiarism_detector = detector
+        admin.reset_plagiarism_scores()
+        assert db_manager.get_plagiarism_report(submission_id) is None
+        db_manager.save_plagiarism_report(submission_id, report, detector.version)
+        db_manager.complete_submission(submission_id, text, 81.0)
+        assert db_manager.get_plagiarism_report(submission_id) is None
+        
+        detector.add_reference_text("A brand new reference text about ocean currents.")
+        assert stored['detector_version'] != detector.version
+
+def test_detection_cache_tiers():
+    """Identical normalized text is scored once; the SQLite tier survives a restart"""
+    from database_manager import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_manager = DatabaseManager(os.path.join(tmp_dir, 'test.db'))
+        db_manager.init_database()
+        model_path = os.path.join(tmp_dir, 'model.pkl')
+        detector = PlagiarismDetector(model_path=model_path, db_manager=db_manager, cache_size=2)
+        
+        text = "Regularization techniques help prevent overfitting in machine learning models, mostly."
+        first = detector.detect_plagiarism(text).plagiarism_score
+        assert detector.detect_plagiarism("  " + text.upper()).plagiarism_score == first
+        assert detector.cache.stats()['misses'] == 1
+        assert detector.cache.stats()['memory_hits'] == 1
+        
+        detector.detect_plagiarism("First filler text to evict entries.")
+        detector.detect_plagiarism("Second filler text to evict entries.")
+        assert detector.cache.stats()['entries'] == 2
+        
+        restarted = PlagiarismDetector(model_path=model_path, db_manager=db_manager)
+        assert restarted.detect_plagiarism(text).plagiarism_score == first
+        assert restarted.cache.stats()['persistent_hits'] == 1
+
+        # A batch writes all of its misses in one transaction
+        writes = []
+        store = restarted.cache._store
+        restarted.cache._store = lambda items, version: writes.append(len(items)) or store(items, version)
+        restarted.detect_plagiarism_batch([f"Batch text number {i} about tidal energy and turbines." for i in range(3)])
+        assert writes == [3]
+
+def test_exact_duplicate_fast_path():
+    """Identical normalized content from another student short-circuits to 100% with their submission"""
+    from database_manager import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_manager = DatabaseManager(os.path.join(tmp_dir, 'test.db'))
+        db_manager.init_database()
+        detector = PlagiarismDetector(model_path=os.path.join(tmp_dir, 'model.pkl'), db_manager=db_manager)
+        
+        text = "The Krebs cycle oxidises acetyl-CoA to carbon dioxide, producing NADH and FADH2."
+        assignment_id = db_manager.create_assignment('Biology', '', '2099-01-01', 100, 1)
+        original_id = db_manager.create_submission(assignment_id, 2, 'a.txt', 'a.txt', 0.0, text)
+        
+        calls = []
+        detector.score_content = lambda documents: calls.append(documents)
+        result = detector.detect_plagiarism("  THE KREBS CYCLE oxidises acetyl-CoA to carbon dioxide,\nproducing NADH and FADH2.")
+        
+        assert result.plagiarism_score == 100.0
+        assert result.best_match == {'source': 'submission', 'submission_id': original_id,
+                                     'assignment_id': assignment_id, 'score': 1.0, 'exact': True}
+        assert calls == []
+        assert detector.detect_plagiarism_batch([text], [assignment_id], student_ids=[3]) == [100.0]
+        
+        # A verbatim copy of a reference text needs no database and no model work either
+        reference = "Machine learning is a subset of artificial intelligence that focuses on algorithms."
+        copied = detector.detect_plagiarism(reference, assignment_id, student_id=2)
+        assert copied.plagiarism_score == 100.0
+        assert copied.best_match['source'] == 'reference' and copied.best_match['exact']
+        assert detector.reference_texts[copied.best_match['reference_index']] == detector.preprocess_text(reference)
+        assert detector.detect_plagiarism_batch([reference], student_ids=[2]) == [100.0]
+        assert calls == []
+        
+        # A submission never matches itself, nor its author's earlier submissions
+        assert detector.find_exact_duplicate(text, exclude_submission_id=original_id) is None
+        del detector.score_content
+        resubmitted = detector.detect_plagiarism(text, assignment_id, student_id=2)
+        assert resubmitted.plagiarism_score < 100.0
+        assert resubmitted.best_match is None or resubmitted.best_match.get('submission_id') != original_id
+        assert detector.detect_plagiarism_batch([text], [assignment_id], student_ids=[2])[0] < 100.0
+
+def test_reextract_outside_write_lock():
+    """Re-extraction parses originals while other connections can still write"""
+    import sqlite3
+    from admin_tools import AdminTools
+    from database_manager import DatabaseManager
+    from file_processor import FileProcessor
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_manager = DatabaseManager(os.path.join(tmp_dir, 'test.db'))
+        db_manager.init_database()
+        assignment_id = db_manager.create_assignment('Essay', '', '2099-01-01', 100, 1)
+        for i in range(3):
+            path = os.path.join(tmp_dir, f'essay{i}.txt')
+            with open(path, 'w') as f:
+                f.write(f"Essay number {i} on the water cycle and evaporation from oceans.")
+            submission_id = db_manager.create_pending_submission(assignment_id, 2, f'essay{i}.txt', path,
+                                                                 file_digest=f'digest{i}')
+            db_manager.complete_submission(submission_id, "Old text", 0.0)
+        
+        admin = AdminTools.__new__(AdminTools)
+        admin.db_manager = db_manager
+        admin.file_processor = FileProcessor()
+        extract = admin.file_processor.extract_text_with_pages
+        def probed_extract(path, digest=None):
+            probe = sqlite3.connect(db_manager.db_path, timeout=0)
+            probe.execute('BEGIN IMMEDIATE')
+            probe.rollback()
+            probe.close()
+            return extract(path, digest)
+        admin.file_processor.extract_text_with_pages = probed_extract
+        admin.reextract_submissions(batch_size=2)
+        
+        assert db_manager.get_submission_text(3) == "Essay number 2 on the water cycle and evaporation from oceans."
+
+def test_submission_worker_pipeline():
+    """Queued submissions are extracted and scored by the worker, with retries on failure"""
+    from database_manager import DatabaseManager
+    from file_processor import FileProcessor
+    from submission_worker import SubmissionWorker
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_manager = DatabaseManager(os.path.join(tmp_dir, 'test.db'))
+        db_manager.init_database()
+        db_manager.job_queue.retry_delay = 0
+        detector = PlagiarismDetector(model_path=os.path.join(tmp_dir, 'model.pkl'), db_manager=db_manager)
+        worker = SubmissionWorker(db_manager, detector, FileProcessor())
+        
+        path = os.path.join(tmp_dir, 'essay.txt')
+        with open(path, 'w') as f:
+            f.write("Photosynthesis converts light energy into chemical energy stored in glucose molecules.")
+        
+        assignment_id = db_manager.create_assignment('Biology', '', '2099-01-01', 100, 1)
+        submission_id = db_manager.create_pending_submission(assignment_id, 2, 'essay.txt', path)
+        assert db_manager.get_submission(submission_id)['status'] == 'stored'
+        assert db_manager.job_queue.counts() == {'queued': 1}
+        
+        assert worker.process_next()
+        assert not worker.process_next()
+        
+        submission = db_manager.get_submission(submission_id)
+        assert submission['status'] == 'scored'
+        assert db_manager.get_submission_text(submission_id).startswith("Photosynthesis")
+        assert submission['content_hash'] is not None
+        assert db_manager.get_plagiarism_report(submission_id)['report_data']['plagiarism_score'] == \
+            round(submission['plagiarism_score'], 2)
+        assert db_manager.job_queue.counts() == {'done': 1}
+        
+        # A job re-run after a crash re-indexes the submission without counting it twice
+        conn = db_manager.get_connection()
+        postings = conn.execute('SELECT COUNT(*) FROM similarity_postings').fetchone()[0]
+        worker.score_submission({'submission_id': submission_id})
+        assert conn.execute('SELECT doc_count FROM similarity_assignments').fetchone()[0] == 1
+        assert conn.execute('SELECT MAX(df) FROM similarity_terms').fetchone()[0] == 1
+        assert conn.execute('SELECT COUNT(*) FROM similarity_postings').fetchone()[0] == postings
+        conn.close()
+        
+        code_id = db_manager.create_submission(assignment_id, 3, 'sort.py', 'sort.py', 0.0,
+                                               "def total(values):\n    return sum(v * 2 for v in values)\n")
+        fingerprints = db_manager.fingerprint_index.fingerprint(db_manager.get_submission_text(code_id))
+        db_manager.complete_submission(code_id, db_manager.get_submission_text(code_id), 0.0)
+        conn = db_manager.get_connection()
+        assert conn.execute('SELECT COUNT(*) FROM code_fingerprints WHERE submission_id = ?',
+                            (code_id,)).fetchone()[0] == len(set(fingerprints))
+        conn.close()
+        
+        missing_id = db_manager.create_pending_submission(assignment_id, 2, 'gone.txt', 'gone.txt')
+        worker.file_processor.extract_text_with_pages = lambda file_path, digest=None: 1 / 0
+        while worker.process_next():
+            pass
+        assert db_manager.get_submission(missing_id)['status'] == 'failed'
+        assert db_manager.job_queue.counts() == {'done': 1, 'failed': 1}
+
+def test_scoring_pool():
+    """Extraction and scoring run in pool processes and a timed-out call replaces the pool"""
+    from database_manager import DatabaseManager
+    from file_processor import FileProcessor
+    from scoring_pool import ScoringPool
+    from submission_worker import SubmissionWorker
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'test.db')
+        model_path = os.path.join(tmp_dir, 'model.pkl')
+        db_manager = DatabaseManager(db_path)
+        db_manager.init_database()
+        detector = PlagiarismDetector(model_path=model_path, db_manager=db_manager)
+        pool = ScoringPool(model_path, db_path, processes=1)
+        worker = SubmissionWorker(db_manager, detector, FileProcessor(), scoring_pool=pool)
+        
+        path = os.path.join(tmp_dir, 'essay.txt')
+        text = "Plate tectonics explains how continents drift over the mantle across millions of years."
+        with open(path, 'w') as f:
+            f.write(text)
+        
+        try:
+            try:
+                pool.extract_text(path, timeout=1e-6)
+                assert False, "expected a timeout"
+            except TimeoutError:
+                pass
+            
+            assert pool.extract_text(path) == text
+            result, report, version = pool.detect_plagiarism(text)
+            local = detector.detect_plagiarism(text)
+            assert abs(result.plagiarism_score - local.plagiarism_score) < 1e-9
+            assert report['plagiarism_score'] == round(local.plagiarism_score, 2)
+            assert version == detector.version
+            
+            assignment_id = db_manager.create_assignment('Geology', '', '2099-01-01', 100, 1)
+            submission_id = db_manager.create_pending_submission(assignment_id, 2, 'essay.txt', path)
+            assert worker.process_next()
+            submission = db_manager.get_submission(submission_id)
+            assert submission['status'] == 'scored'
+            assert submission['content_hash'] == result.document.content_hash
+        finally:
+            pool.close()
+
+def test_status_event_stream():
+    """The worker publishes each transition and the SSE stream ends at a terminal status"""
+    from database_manager import DatabaseManager
+    from file_processor import FileProcessor
+    from status_events import StatusBroker
+    from submission_worker import SubmissionWorker
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_manager = DatabaseManager(os.path.join(tmp_dir, 'test.db'))
+        db_manager.init_database()
+        detector = PlagiarismDetector(model_path=os.path.join(tmp_dir, 'model.pkl'), db_manager=db_manager)
+        broker = StatusBroker()
+        worker = SubmissionWorker(db_manager, detector, FileProcessor(), status_broker=broker)
+        
+        path = os.path.join(tmp_dir, 'essay.txt')
+        with open(path, 'w') as f:
+            f.write("Volcanic eruptions release ash and sulfur dioxide that can cool the climate for years.")
+        
+        assignment_id = db_manager.create_assignment('Geology', '', '2099-01-01', 100, 1)
+        submission_id = db_manager.create_pending_submission(assignment_id, 2, 'essay.txt', path)
+        status = db_manager.get_submission_status(submission_id)
+        assert status['status'] == 'stored'
+        
+        stream = broker.stream(submission_id, {'submission_id': submission_id, 'status': status['status']})
+        assert json.loads(next(stream).split('data: ')[1])['status'] == 'stored'
+        
+        worker.process_next()
+        events = [json.loads(message.split('data: ')[1]) for message in stream]
+        assert [event['status'] for event in events] == ['extracted', 'scored']
+        assert events[-1]['plagiarism_score'] == round(db_manager.get_submission(submission_id)['plagiarism_score'], 2)
+        assert broker.latest(submission_id) == events[-1]
+        
+        # Subscribers are released once the stream finishes
+        assert broker._subscribers == {}
+
+def test_pdf_page_extraction():
+    """Large PDFs are parsed as parallel page ranges and reports point at matching pages"""
+    from file_processor import FileProcessor
+    from scoring_pool import ScoringPool
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'thesis.pdf')
+        pages = [f"Chapter {number} discusses unrelated field observations of coastal birds." for number in range(1, 8)]
+        pages[2] = "Overfitting occurs when a model learns the training data too well."
+        write_pdf(path, pages)
+        
+        serial = FileProcessor()
+        parallel = FileProcessor(pdf_parallel_pages=3, pdf_chunk_pages=2)
+        assert parallel.pdf_page_ranges(7) == [(0, 2), (2, 4), (4, 6), (6, 7)]
+        
+        text, offsets = serial.extract_text_with_pages(path)
+        assert parallel.extract_text_with_pages(path) == (text, offsets)
+        assert serial.extract_from_pdf(path) == text
+        assert len(offsets) == 7
+        assert text[offsets[2]:offsets[3]].startswith("Overfitting occurs")
+        assert serial.extract_text_with_pages(__file__)[1] is None
+        
+        model_path = os.path.join(tmp_dir, 'model.pkl')
+        detector = PlagiarismDetector(model_path=model_path)
+        report = detector.get_detailed_report(text, page_offsets=offsets)
+        assert report['page_count'] == 7
+        assert report['best_match']['source'] == 'reference'
+        assert report['matched_pages'][0]['page'] == 3
+        
+        pool = ScoringPool(model_path, processes=2, file_processor=parallel)
+        try:
+            assert pool.extract_text_with_pages(path) == (text, offsets)
+        finally:
+            pool.close()
+
+def test_extraction_cache():
+    """Identical file bytes are parsed once and cached text outlives the original file"""
+    from extraction_cache import ExtractionCache
+    from file_processor import FileProcessor
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        processor = FileProcessor(extraction_cache=ExtractionCache(os.path.join(tmp_dir, 'cache')))
+        text = "Tides are caused by the gravitational pull of the moon and the sun.\n"
+        paths = [os.path.join(tmp_dir, name) for name in ('a.txt', 'b.txt', 'c.py')]
+        for path in paths:
+            with open(path, 'w') as f:
+                f.write(text)
+        
+        calls = []
+        parse = processor._extract_text
+        processor._extract_text = lambda filepath: calls.append(filepath) or parse(filepath)
+        
+        assert processor.extract_text(paths[0]) == text
+        assert processor.extract_text(paths[1]) == text
+        assert calls == [paths[0]]
+        
+        # The extension picks the extractor, so it is part of the key
+        processor.extract_text(paths[2])
+        assert calls == [paths[0], paths[2]]
+        
+        digest = processor.file_digest(paths[0])
+        os.remove(paths[0])
+        assert processor.cached_extraction(paths[0], digest) == (text, None)
+        
+        cache = ExtractionCache(os.path.join(tmp_dir, 'small'))
+        cache.put('a' * 64, {'text': 'first'})
+        os.utime(cache.path_for('a' * 64), (1, 1))
+        cache.max_bytes = int(cache.size() * 2.5)
+        cache.put('b' * 64, {'text': 'other'})
+        cache.put('c' * 64, {'text': 'third'})
+        assert cache.get('a' * 64) is None
+        assert cache.get('c' * 64) == {'text': 'third'}
+
+def test_blob_store_dedup():
+    """Uploads are stored once under their SHA-256 and kept while any submission is recent"""
+    import hashlib
+    import io
+    from blob_store import BlobStore
+    from database_manager import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = BlobStore(os.path.join(tmp_dir, 'uploads'), chunk_size=4)
+        data = b"Essay bytes shared by two group members."
+        digest = hashlib.sha256(data).hexdigest()
+        
+        first = store.put(io.BytesIO(data), 'txt')
+        second = store.put(io.BytesIO(data), 'txt')
+        assert first == second == {'path': store.path_for(digest, 'txt'), 'digest': digest, 'size': len(data)}
+        assert first['path'].endswith(os.path.join(digest[:2], digest[2:4], digest + '.txt'))
+        assert os.listdir(store.temp_dir) == []
+        with open(first['path'], 'rb') as f:
+            assert f.read() == data
+        
+        db_manager = DatabaseManager(os.path.join(tmp_dir, 'test.db'))
+        db_manager.init_database()
+        assignment_id = db_manager.create_assignment('Essay', '', '2099-01-01', 100, 1)
+        old_id = db_manager.create_pending_submission(assignment_id, 2, 'essay.txt', first['path'], digest, len(data))
+        conn = db_manager.get_connection()
+        conn.execute("UPDATE submissions SET submitted_at = datetime('now', '-60 days') WHERE id = ?", (old_id,))
+        conn.commit()
+        conn.close()
+        assert db_manager.get_expired_file_paths(30) == [first['path']]
+        
+        db_manager.create_pending_submission(assignment_id, 3, 'copy.txt', second['path'], digest, len(data))
+        assert db_manager.get_expired_file_paths(30) == []
+        
+        store.remove(first['path'])
+        assert os.listdir(store.root) == ['tmp']
+
+def test_upload_ingest_single_pass():
+    """Uploads are hashed, size-checked and sniffed while they are written to the blob store"""
+    import hashlib
+    import io
+    from blob_store import BlobStore
+    from file_processor import FileProcessor
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = BlobStore(os.path.join(tmp_dir, 'uploads'), chunk_size=16)
+        processor = FileProcessor()
+        processor.max_file_size = 64
+        
+        data = b"def area(r):\n    return 3.14 * r * r\n"
+        blob, error = processor.ingest_upload(io.BytesIO(data), 'shapes.py', store)
+        assert error is None
+        assert blob['digest'] == hashlib.sha256(data).hexdigest()
+        assert blob['size'] == len(data)
+        assert blob['file_type'] == 'py'
+        assert blob['path'].endswith('.py')
+        
+        # The real type wins over the extension
+        blob, error = processor.ingest_upload(io.BytesIO(b"%PDF-1.4 not really"), 'essay.txt', store)
+        assert blob['file_type'] == 'pdf'
+        blob, error = processor.ingest_upload(io.BytesIO(b"Plain prose saved as a pdf"), 'essay.pdf', store)
+        assert blob['file_type'] == 'txt'
+        
+        for data, filename, message in ((b"\x7fELF\x00\x01binary", 'essay.txt', 'does not match'),
+                                        (b"PK\x03\x04archive", 'essay.txt', 'does not match'),
+                                        (b"x" * 65, 'essay.txt', 'exceeds maximum'),
+                                        (b"", 'essay.txt', 'empty')):
+            blob, error = processor.ingest_upload(io.BytesIO(data), filename, store)
+            assert blob is None and message in error
+        
+        assert os.listdir(store.temp_dir) == []
+
+def test_extract_text_from_stream():
+    """In-memory extraction matches file extraction and spares the worker a disk read"""
+    import io
+    from blob_store import BlobStore
+    from database_manager import DatabaseManager
+    from file_processor import FileProcessor
+    from submission_worker import SubmissionWorker
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        processor = FileProcessor()
+        samples = {
+            'notes.txt': "Caf\u00e9 notes\r\non soil erosion.\n".encode('utf-8'),
+            'main.c': b"int main() { /* entry\npoint */ return 0; } // done\n",
+        }
+        pdf_path = os.path.join(tmp_dir, 'report.pdf')
+        write_pdf(pdf_path, ["First page of the report", "Second page of the report"])
+        with open(pdf_path, 'rb') as f:
+            samples['report.pdf'] = f.read()
+        
+        for filename, data in samples.items():
+            path = os.path.join(tmp_dir, filename)
+            with open(path, 'wb') as f:
+                f.write(data)
+            expected = processor.extract_text_with_pages(path)
+            spooled = tempfile.SpooledTemporaryFile()
+            spooled.write(data)
+            for source in (data, memoryview(data), io.BytesIO(data), spooled):
+                assert processor.extract_text_with_pages_from_stream(source, filename) == expected
+            assert processor.extract_text_from_stream(data, filename) == expected[0]
+        
+        db_manager = DatabaseManager(os.path.join(tmp_dir, 'test.db'))
+        db_manager.init_database()
+        detector = PlagiarismDetector(model_path=os.path.join(tmp_dir, 'model.pkl'), db_manager=db_manager)
+        worker = SubmissionWorker(db_manager, detector, processor)
+        
+        store = BlobStore(os.path.join(tmp_dir, 'uploads'))
+        blob, error = processor.ingest_upload(io.BytesIO(samples['notes.txt']), 'notes.txt', store, extract=True)
+        assert (blob['text'], blob['page_offsets']) == processor.extract_text_with_pages(
+            os.path.join(tmp_dir, 'notes.txt'))
+        
+        # Parsing a PDF would hold up the request thread, so it is left to the worker
+        pdf_blob, error = processor.ingest_upload(io.BytesIO(samples['report.pdf']), 'report.pdf', store, extract=True)
+        assert error is None and 'text' not in pdf_blob
+        
+        assignment_id = db_manager.create_assignment('Soil', '', '2099-01-01', 100, 1)
+        submission_id = db_manager.create_pending_submission(
+            assignment_id, 2, 'notes.txt', blob['path'], blob['digest'], blob['size'],
+            blob['text'], blob['page_offsets']
+        )
+        worker.extract_text_with_pages = lambda *args: 1 / 0
+        worker.process_next()
+        submission = db_manager.get_submission(submission_id)
+        assert submission['status'] == 'scored'
+        assert db_manager.get_submission_text(submission_id) == blob['text']
+
+def test_docx_streaming_extraction():
+    """DOCX text includes paragraphs and table rows in order, from a path or a stream"""
+    import io
+    import docx
+    from file_processor import FileProcessor
+    
+    document = docx.Document()
+    document.add_paragraph("Rivers shape the landscape.")
+    table = document.add_table(rows=2, cols=2)
+    for row, cells in enumerate((("River", "Length"), ("Nile", "6650 km"))):
+        for column, text in enumerate(cells):
+            table.cell(row, column).text = text
+    closing = document.add_paragraph("Closing ")
+    closing.add_run("remarks").bold = True
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'rivers.docx')
+        document.save(path)
+        
+        processor = FileProcessor()
+        expected = "Rivers shape the landscape.\nRiver\tLength\nNile\t6650 km\nClosing remarks\n"
+        assert processor.extract_text(path) == expected
+        with open(path, 'rb') as f:
+            assert processor.extract_text_from_stream(f.read(), 'rivers.docx') == expected
+        assert list(processor.iter_docx_lines(path))[1] == "River\tLength"
+
+def test_zip_archive_extraction():
+    """ZIP members are extracted into one document with a boundary per file, within limits"""
+    import io
+    import zipfile
+    from blob_store import BlobStore
+    from file_processor import FileProcessor
+    from scoring_pool import ScoringPool
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'project.zip')
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('src/main.py', "print('hi')  # greet\n")
+            archive.writestr('README.txt', "Run main.py")
+            archive.writestr('src/', '')
+            archive.writestr('__MACOSX/src/._main.py', 'x')
+            archive.writestr('build/app.exe', 'MZ')
+        
+        processor = FileProcessor()
+        expected = "===== src/main.py =====\nprint('hi')  \n\n===== README.txt =====\nRun main.py\n"
+        assert processor.archive_members(path) == ['src/main.py', 'README.txt']
+        assert processor.extract_text(path) == expected
+        with open(path, 'rb') as f:
+            data = f.read()
+        assert processor.extract_text_from_stream(data, 'project.zip') == expected
+        
+        store = BlobStore(os.path.join(tmp_dir, 'uploads'))
+        blob, error = processor.ingest_upload(io.BytesIO(data), 'project.zip', store, extract=True)
+        assert error is None and blob['file_type'] == 'zip' and 'text' not in blob
+        
+        pool = ScoringPool(os.path.join(tmp_dir, 'model.pkl'), processes=2)
+        try:
+            assert pool.extract_text(path) == expected
+        finally:
+            pool.close()
+        
+        bomb = io.BytesIO()
+        with zipfile.ZipFile(bomb, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('zeros.txt', b'0' * (4 * 1024 * 1024))
+        blob, error = processor.ingest_upload(io.BytesIO(bomb.getvalue()), 'bomb.zip', store)
+        assert blob is None and 'compressed more than' in error
+        
+        processor.max_archive_members = 1
+        blob, error = processor.ingest_upload(io.BytesIO(data), 'project.zip', store)
+        assert blob is None and 'more than 1 files' in error
+        assert os.listdir(store.temp_dir) == []
+
+def test_connection_pool_reuse():
+    """Closed connections are reused, lose uncommitted work, and are shared within a Flask request"""
+    import sqlite3
+    from flask import Flask
+    from database_manager import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_manager = DatabaseManager(os.path.join(tmp_dir, 'test.db'), pool_size=1,
+                                     pragmas={'cache_size': -4000})
+        db_manager.init_database()
+        
+        conn = db_manager.get_connection()
+        assert conn.execute('PRAGMA cache_size').fetchone()[0] == -4000
+        conn.execute("UPDATE users SET full_name = 'Changed'")
+        conn.close()
+        conn.close()
+        again = db_manager.get_connection()
+        assert again.conn is conn.conn
+        # A stray second close of the earlier lease does not release the connection from under its new holder
+        conn.close()
+        assert db_manager.pool._idle == []
+        assert again.execute("SELECT COUNT(*) FROM users WHERE full_name = 'Changed'").fetchone()[0] == 0
+        
+        # Only pool_size connections are kept; the spare one is really closed
+        spare = db_manager.get_connection()
+        again.close()
+        spare.close()
+        try:
+            spare.execute('SELECT 1')
+            assert False, "expected the spare connection to be closed"
+        except sqlite3.ProgrammingError:
+            pass
+        
+        # An idle connection that fails its health check is replaced
+        db_manager.pool.health_check_interval = 0
+        conn.conn.discard()
+        assert db_manager.get_connection().conn is not conn.conn
+        
+        db_manager.pool.pool_size = 2  # room for the nested caller's connection as well
+        app = Flask(__name__)
+        db_manager.init_app(app)
+        with app.app_context():
+            first = db_manager.get_connection()
+            db_manager.get_assignment(1)
+            first.close()
+            second = db_manager.get_connection()
+            assert first.conn is second.conn
+            
+            # A caller asking while the request's connection is out gets its own, so its commit
+            # leaves the outer caller's transaction alone
+            second.execute("UPDATE users SET full_name = 'Outer'")
+            nested = db_manager.get_connection()
+            assert nested.conn is not second.conn
+            nested.commit()
+            nested.close()
+            second.close()
+            first.close()
+            assert db_manager.get_connection().execute(
+                "SELECT COUNT(*) FROM users WHERE full_name = 'Outer'").fetchone()[0] == 0
+        assert first.conn in db_manager.pool._idle
+
+def test_storage_profiles():
+    """The WAL profile lets readers run during a write, and backups include un-checkpointed commits"""
+    import sqlite3
+    from database_manager import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'test.db')
+        db_manager = DatabaseManager(db_path, storage_profile='wal')
+        db_manager.init_database()
+        conn = db_manager.get_connection()
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+        conn.close()
+        
+        assignment_id = db_manager.create_assignment('Essay', '', '2099-01-01', 100, 1)
+        writer = db_manager.pool.acquire()
+        writer.execute("UPDATE assignments SET title = 'Draft' WHERE id = ?", (assignment_id,))
+        assert db_manager.get_assignment(assignment_id)['title'] == 'Essay'
+        writer.commit()
+        writer.close()
+        
+        backup_path = os.path.join(tmp_dir, 'backup.db')
+        db_manager.backup(backup_path)
+        backup = sqlite3.connect(backup_path)
+        assert backup.execute('SELECT title FROM assignments WHERE id = ?', (assignment_id,)).fetchone()[0] == 'Draft'
+        backup.close()
+        
+        busy, frames, checkpointed = db_manager.checkpoint('TRUNCATE')
+        assert busy == 0 and frames == checkpointed == 0
+        assert os.path.getsize(db_path + '-wal') == 0
+        
+        db_manager.pool.close_all()
+        rollback = DatabaseManager(db_path, storage_profile='rollback')
+        conn = rollback.get_connection()
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+        conn.close()
+        
+        try:
+            DatabaseManager(db_path, storage_profile='fast')
+            assert False, "expected an unknown profile to be rejected"
+        except ValueError:
+            pass
+
+def test_dashboard_query_plans():
+    """Dashboard queries are answered from indexes, never by a full scan or a sort"""
+    import re
+    from database_manager import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_manager = DatabaseManager(os.path.join(tmp_dir, 'test.db'), pool_size=1)
+        db_manager.init_database()
+        assignment_id = db_manager.create_assignment('Essay', '', '2099-01-01', 100, 1)
+        
+        # A pending upload's placeholder 0.0 does not drag the statistics down
+        db_manager.create_submission(assignment_id, 2, 'a.txt', 'a.txt', 42.0, "Scored essay about rivers.")
+        db_manager.create_pending_submission(assignment_id, 3, 'b.txt', 'b.txt')
+        stats = db_manager.get_plagiarism_statistics()
+        assert stats['total_submissions'] == 1 and stats['avg_plagiarism_score'] == 42.0
+        
+        # Record the SQL each query runs, with its parameters bound
+        lease = db_manager.get_connection()
+        conn = lease.conn  # pool_size=1, so every query below runs on this connection
+        statements = []
+        conn.set_trace_callback(statements.append)
+        lease.close()
+        queries = {
+            'get_student_submissions': lambda: db_manager.get_student_submissions(2),
+            'get_assignment_submissions': lambda: db_manager.get_assignment_submissions(assignment_id),
+            'get_lecturer_assignments': lambda: db_manager.get_lecturer_assignments(1),
+            'get_available_assignments': lambda: db_manager.get_available_assignments(),
+            'get_recent_submissions': lambda: db_manager.get_recent_submissions(),
+            'get_expired_file_paths': lambda: db_manager.get_expired_file_paths(30),
+            'get_plagiarism_statistics': lambda: db_manager.get_plagiarism_statistics(),
+        }
+        plans = {}
+        for name, query in queries.items():
+            statements.clear()
+            query()
+            plans[name] = [row[3] for sql in statements for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+        conn.set_trace_callback(None)
+        
+        for name, plan in plans.items():
+            for step in plan:
+                assert not re.match(r'SCAN \w+$', step), f"{name} scans a table: {plan}"
+                assert 'TEMP B-TREE' not in step, f"{name} sorts its results: {plan}"
+        assert 'SEARCH s USING COVERING INDEX idx_submissions_assignment (assignment_id=?)' in \
+            plans['get_lecturer_assignments']
+        
+        # An older database that has the index on other columns gets it rebuilt by the migration
+        conn = db_manager.get_connection()
+        conn.execute('DROP INDEX idx_submissions_student')
+        conn.execute('CREATE INDEX idx_submissions_student ON submissions (student_id)')
+        conn.execute('DELETE FROM schema_version WHERE version >= 6')
+        conn.commit()
+        conn.close()
+        db_manager.init_database()
+        conn = db_manager.get_connection()
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'idx_submissions_student'").fetchone()[0]
+        conn.close()
+        assert sql.endswith('(student_id, submitted_at DESC)')
+
+def test_schema_migrations():
+    """Migrations upgrade a pre-versioned database once, and backfills run in resumable batches"""
+    import sqlite3
+    import migrations
+    from database_manager import DatabaseManager
+    from migrations import Backfill, Migration, MigrationRunner
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_manager = DatabaseManager(os.path.join(tmp_dir, 'test.db'))
+        
+        # A database from the first release: base tables only, no schema_version
+        conn = db_manager.get_connection()
+        migrations.create_base_tables(db_manager, conn.cursor())
+        for i in range(5):
+            conn.execute('''
+                INSERT INTO submissions (assignment_id, student_id, filename, file_path, content)
+                VALUES (1, 2, 'essay.txt', 'uploads/essay.txt', ?)
+            ''', (f"Legacy essay number {i} about glaciers carving valleys over many centuries.",))
+        conn.commit()
+        conn.close()
+        
+        db_manager.migrations.migrate(backfill=False)
+        assert db_manager.migrations.current_version() == migrations.MIGRATIONS[-1].version
+        assert db_manager.migrations.migrate() == []
+        
+        conn = db_manager.get_connection()
+        indexed = "SELECT COUNT(*) FROM submissions WHERE status = 'scored' AND analysis IS NOT NULL"
+        assert conn.execute(indexed).fetchone()[0] == 5
+        
+        # Text moved out of the submissions row, compressed, and only loaded on request
+        assert conn.execute('SELECT COUNT(*) FROM submissions WHERE content IS NOT NULL').fetchone()[0] == 0
+        assert conn.execute('SELECT COUNT(*) FROM submission_texts').fetchone()[0] == 5
+        conn.close()
+        assert db_manager.get_submission_text(1) == \
+            "Legacy essay number 0 about glaciers carving valleys over many centuries."
+        assert [entry[0] for entry in db_manager.get_submission_texts(batch_size=2)] == [1, 2, 3, 4, 5]
+        db_manager.create_default_users()
+        listed = db_manager.get_assignment_submissions(1)
+        assert len(listed) == 5 and not {'content', 'analysis', 'minhash'} & set(listed[0])
+        
+        # A backfill that fails part-way resumes after its last committed batch
+        seen = []
+        def mark(db_manager, cursor, rows):
+            if len(seen) == 2:
+                seen.append('interrupted')
+                raise RuntimeError("interrupted")
+            seen.extend(row['id'] for row in rows)
+            cursor.executemany('UPDATE submissions SET feedback = ? WHERE id = ?',
+                               [('migrated', row['id']) for row in rows])
+        extra = Migration(100, 'Mark feedback', backfill=Backfill('submissions', 'feedback IS NULL', mark,
+                                                                  columns='id', batch_size=2))
+        runner = MigrationRunner(db_manager, [extra], batch_pause=0)
+        try:
+            runner.migrate()
+            assert False, "expected the backfill to be interrupted"
+        except RuntimeError:
+            pass
+        runner.migrate()
+        assert seen == [1, 2, 'interrupted', 3, 4, 5]
+        
+        conn = db_manager.get_connection()
+        assert conn.execute("SELECT COUNT(*) FROM submissions WHERE feedback = 'migrated'").fetchone()[0] == 5
+        assert conn.execute('SELECT backfilled_to FROM schema_version WHERE version = 100').fetchone()[0] == 5
+        conn.close()
+        assert runner.run_backfill(extra) == 0
+        
+        # Batches are prepared while another connection can still take the write lock
+        def prepare(db_manager, rows):
+            probe = sqlite3.connect(db_manager.db_path, timeout=0)
+            probe.execute('BEGIN IMMEDIATE')
+            probe.rollback()
+            probe.close()
+            return [(90 + row['id'], row['id']) for row in rows]
+        def grade(db_manager, cursor, scores):
+            cursor.executemany('UPDATE submissions SET score = ? WHERE id = ?', scores)
+        graded = Migration(101, 'Grade', backfill=Backfill('submissions', 'score IS NULL', grade, columns='id',
+                                                          batch_size=2, prepare=prepare))
+        MigrationRunner(db_manager, [graded], batch_pause=0).migrate()
+        conn = db_manager.get_connection()
+        assert [row[0] for row in conn.execute('SELECT score FROM submissions ORDER BY id')] == [91, 92, 93, 94, 95]
+        
+        # Analysis stored before it was trimmed to fixed-size counts loses its sentence offsets
+        conn.execute('UPDATE submissions SET analysis = ? WHERE id = 1',
+                     (json.dumps({'word_count': 3, 'sentence_breaks': [4, 9]}),))
+        conn.commit()
+        trim = Migration(102, 'Trim analysis', backfill=migrations.MIGRATIONS[-1].backfill)
+        MigrationRunner(db_manager, [trim], batch_pause=0).migrate()
+        assert json.loads(conn.execute('SELECT analysis FROM submissions WHERE id = 1').fetchone()[0]) == \
+            {'word_count': 3}
+        conn.close()
+
 if __name__ == "__main__":
     test_plagiarism_detection()
     test_file_processing()
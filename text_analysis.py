@@ -0,0 +1,111 @@
+"""
+Text normalisation shared by the plagiarism detector and the submission indexes
+"""
+
+import hashlib
+import re
+from collections import Counter
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+TOKEN_PATTERN = re.compile(r'\w+')
+SENTENCE_BREAK_PATTERN = re.compile(r'[.!?]+')
+PUNCTUATION = '.,!?;:'
+
+def preprocess_text(text):
+    """Clean and preprocess text for analysis"""
+    # Remove extra whitespace and normalize
+    text = re.sub(r'\s+', ' ', text.strip())
+    
+    # Remove special characters but keep basic punctuation
+    text = re.sub(r'[^\w\s.,!?;:]', '', text)
+    
+    # Convert to lowercase
+    text = text.lower()
+    
+    return text
+
+def tokenize(processed_text):
+    """Split preprocessed text into content words, dropping stop words"""
+    return content_words(TOKEN_PATTERN.findall(processed_text))
+
+def content_hash(processed_text):
+    return hashlib.sha256(processed_text.encode('utf-8')).hexdigest()
+
+def content_words(tokens):
+    return [token for token in tokens if len(token) > 1 and token not in ENGLISH_STOP_WORDS]
+
+class AnalyzedDocument:
+    """Tokens, counts and sentence boundaries of one text, computed once and shared"""
+    
+    def __init__(self, text, processed_text=None):
+        self.text = text or ''
+        self.processed_text = preprocess_text(self.text) if processed_text is None else processed_text
+        
+        self.words = self.processed_text.split()
+        self.word_counts = Counter(self.words)
+        self.tokens = TOKEN_PATTERN.findall(self.processed_text)
+        
+        # End offset of every run of sentence terminators in processed_text
+        self.sentence_breaks = [match.end() for match in SENTENCE_BREAK_PATTERN.finditer(self.processed_text)]
+        
+        self.word_count = len(self.words)
+        self.char_count = len(self.processed_text)
+        self.unique_word_count = len(self.word_counts)
+        self.sentence_count = len(self.sentence_breaks) + 1
+        self.punctuation_count = sum(self.processed_text.count(mark) for mark in PUNCTUATION)
+        self._content_tokens = None
+        self._content_hash = None
+    
+    @classmethod
+    def from_processed(cls, processed_text):
+        """Analyze text that has already been through preprocess_text"""
+        return cls(processed_text, processed_text=processed_text)
+    
+    @property
+    def content_tokens(self):
+        """Tokens with stop words removed, as used by the similarity index"""
+        if self._content_tokens is None:
+            self._content_tokens = content_words(self.tokens)
+        return self._content_tokens
+    
+    @property
+    def content_hash(self):
+        """SHA-256 of the normalized text; equal for byte- or normalization-identical texts"""
+        if self._content_hash is None:
+            self._content_hash = content_hash(self.processed_text)
+        return self._content_hash
+    
+    @property
+    def avg_word_length(self):
+        if not self.word_count:
+            return float('nan')
+        return sum(len(word) * count for word, count in self.word_counts.items()) / self.word_count
+    
+    def sentences(self):
+        """Yield the sentences of processed_text using the stored boundaries"""
+        start = 0
+        for end in self.sentence_breaks:
+            yield self.processed_text[start:end].strip()
+            start = end
+        if start < len(self.processed_text):
+            yield self.processed_text[start:].strip()
+    
+    def to_dict(self):
+        """Fixed-size summary for storing in the submissions row
+        
+        Sentence boundaries grow with the text and are cheap to recompute, so they are left out.
+        """
+        return {
+            'word_count': self.word_count,
+            'char_count': self.char_count,
+            'unique_word_count': self.unique_word_count,
+            'sentence_count': self.sentence_count,
+            'punctuation_count': self.punctuation_count,
+            'avg_word_length': self.avg_word_length if self.word_count else None
+        }
+
+def analyze(text):
+    """Return text as an AnalyzedDocument, reusing it if it already is one"""
+    if isinstance(text, AnalyzedDocument):
+        return text
+    return AnalyzedDocument(text)